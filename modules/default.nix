@@ -89,6 +89,28 @@ in
       '';
     };
 
+    prepareJobs = lib.mkOption {
+      type = types.ints.positive;
+      default = 1;
+      example = 4;
+      description = ''
+        Number of config files to read and prepare concurrently before writing them.
+
+        Raising this can shorten activation on setups with many users or installed games, especially when libraries live on slow drives.
+      '';
+    };
+
+    compactShortcuts = lib.mkOption {
+      type = types.bool;
+      default = false;
+      example = true;
+      description = ''
+        Renumber non-Steam shortcuts so their indices stay contiguous after some are removed.
+
+        Shortcuts keep their order; only the numbering in `shortcuts.vdf` changes.
+      '';
+    };
+
     desktopEntries = lib.mkOption {
       type =
         types.coercedTo types.bool
@@ -240,7 +262,7 @@ in
       );
 
       patcherConfig = builtins.toJSON {
-        inherit (cfg) onSteamRunning;
+        inherit (cfg) onSteamRunning prepareJobs compactShortcuts;
         defaultCompatTool = mkCompatToolValue cfg.defaultCompatTool;
         apps = mapFinalConfigs enabledApps;
         nonSteamApps = mapFinalConfigs enabledNonSteamApps;
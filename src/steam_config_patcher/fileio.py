@@ -1,15 +1,54 @@
+import hashlib
 import os
 from pathlib import Path
+from typing import BinaryIO, Callable, Optional
 
+FileWriter = Callable[[BinaryIO], None]
 
-def atomic_write_bytes(path: Path, data: bytes) -> None:
+# (size, mtime_ns, inode), or None when the file doesn't exist
+FileState = Optional[tuple[int, int, int]]
+
+# filesystem timestamps can trail the wall clock by a tick, so a file whose
+# mtime is this close to when we started reading it may have changed under us
+RACY_WINDOW_NS = 2_000_000_000
+
+
+def file_state(path: Path) -> FileState:
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        return None
+    return stat.st_size, stat.st_mtime_ns, stat.st_ino
+
+
+def is_racy(state: FileState, read_started_ns: int) -> bool:
+    return state is not None and state[1] >= read_started_ns - RACY_WINDOW_NS
+
+
+def atomic_write(path: Path, write: FileWriter) -> None:
     tmp_path = path.with_name(path.name + ".tmp")
-    with tmp_path.open("wb") as f:
-        f.write(data)
-        f.flush()
-        os.fsync(f.fileno())
+    try:
+        with tmp_path.open("wb") as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
     tmp_path.replace(path)
 
 
+def atomic_write_bytes(path: Path, data: bytes) -> None:
+    atomic_write(path, lambda f: f.write(data))
+
+
 def atomic_write_text(path: Path, text: str) -> None:
     atomic_write_bytes(path, text.encode("utf-8"))
+
+
+def file_digest(path: Path) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    with path.open("rb") as handle:
+        for chunk in iter(lambda: handle.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
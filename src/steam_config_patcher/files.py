@@ -1,28 +1,41 @@
+import errno
+import fcntl
 import hashlib
 import logging
 import os
 import shutil
+import stat
+import time
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from pathlib import Path, PurePosixPath
 from typing import Iterator, Optional
 
+from steam_config_patcher.fileio import is_racy
 from steam_config_patcher.files_manifest import (
     backup_path,
     load_files_manifest,
     save_files_manifest,
 )
-from steam_config_patcher.steam import find_app_compat_prefix, find_app_install_dir
+from steam_config_patcher.steam import SteamLibraryIndex
+from steam_config_patcher.store_hashes import StoreHashCache, store_hashes_path
 from steam_config_patcher.types import (
     FileOp,
     FilesManifest,
     ManagedDir,
     ManagedFile,
     RemoveOp,
+    TargetState,
 )
 
 LOG = logging.getLogger(__name__)
 
 FileKey = tuple[int, str, str]
+Hashes = dict[Path, str]
+
+HASH_BUFFER_SIZE = 1 << 20
+COPY_BUFFER_SIZE = 1 << 20
+HASH_JOBS = min(8, os.cpu_count() or 1)
 
 
 class FileOpConflict(ValueError):
@@ -43,12 +56,40 @@ class _Placement:
 
 def _hash_file(path: Path) -> str:
     digest = hashlib.sha256()
-    with path.open("rb") as handle:
-        for chunk in iter(lambda: handle.read(65536), b""):
-            digest.update(chunk)
+    buffer = bytearray(HASH_BUFFER_SIZE)
+    view = memoryview(buffer)
+    with path.open("rb", buffering=0) as handle:
+        while size := handle.readinto(buffer):
+            digest.update(view[:size])
     return digest.hexdigest()
 
 
+def _try_hash(path: Path) -> Optional[str]:
+    try:
+        return _hash_file(path)
+    except OSError:
+        return None
+
+
+def _hash_files(paths: set[Path], jobs: int = HASH_JOBS) -> Hashes:
+    # hashlib releases the GIL while digesting, so large files hash in parallel;
+    # paths that cannot be read are left out and hashed again where needed
+    ordered = sorted(paths)
+    if jobs > 1 and len(ordered) > 1:
+        with ThreadPoolExecutor(max_workers=min(jobs, len(ordered))) as pool:
+            results = list(pool.map(_try_hash, ordered))
+    else:
+        results = [_try_hash(path) for path in ordered]
+    return {
+        path: digest for path, digest in zip(ordered, results) if digest is not None
+    }
+
+
+def _lookup_hash(hashes: Hashes, path: Path) -> str:
+    digest = hashes.get(path)
+    return digest if digest is not None else _hash_file(path)
+
+
 def _resolve_mode(executable: Optional[bool], source_file: Path) -> int:
     if executable is True:
         return 0o755
@@ -144,15 +185,163 @@ def _backup_once(
     shutil.copy2(target_path, stored, follow_symlinks=False)
 
 
+# _IOW(0x94, 9, int) from linux/fs.h
+FICLONE = 0x40049409
+
+
+def _reflink(src_fd: int, dst_fd: int, size: int) -> None:
+    fcntl.ioctl(dst_fd, FICLONE, src_fd)
+
+
+def _copy_range(src_fd: int, dst_fd: int, size: int) -> None:
+    copied = 0
+    while copied < size:
+        count = os.copy_file_range(src_fd, dst_fd, size - copied)
+        if count == 0:
+            raise OSError(errno.EIO, "copy_file_range stopped short")
+        copied += count
+
+
+def _sendfile(src_fd: int, dst_fd: int, size: int) -> None:
+    copied = 0
+    while copied < size:
+        count = os.sendfile(dst_fd, src_fd, copied, size - copied)
+        if count == 0:
+            raise OSError(errno.EIO, "sendfile stopped short")
+        copied += count
+
+
+def _read_write(src_fd: int, dst_fd: int, size: int) -> None:
+    while chunk := os.read(src_fd, COPY_BUFFER_SIZE):
+        view = memoryview(chunk)
+        while view:
+            view = view[os.write(dst_fd, view) :]
+
+
+# tried in order; reflinks share extents on btrfs/xfs, the next two copy
+# inside the kernel, and the last one always works
+_COPY_METHODS = (
+    ("reflink", _reflink),
+    ("copy_file_range", _copy_range),
+    ("sendfile", _sendfile),
+    ("read/write", _read_write),
+)
+
+
+def _copy_file(source_file: Path, dest: Path) -> str:
+    with source_file.open("rb") as src, dest.open("wb") as dst:
+        src_fd, dst_fd = src.fileno(), dst.fileno()
+        size = os.fstat(src_fd).st_size
+        for name, copy in _COPY_METHODS[:-1]:
+            try:
+                copy(src_fd, dst_fd, size)
+                return name
+            except OSError:
+                os.lseek(src_fd, 0, os.SEEK_SET)
+                os.lseek(dst_fd, 0, os.SEEK_SET)
+                os.ftruncate(dst_fd, 0)
+        name, copy = _COPY_METHODS[-1]
+        copy(src_fd, dst_fd, size)
+        return name
+
+
 def _atomic_place(source_file: Path, target_path: Path, mode: int) -> None:
     tmp = target_path.with_name(target_path.name + ".steam-config-nix-tmp")
-    shutil.copy2(source_file, tmp)
-    tmp.chmod(mode)
+    try:
+        method = _copy_file(source_file, tmp)
+        shutil.copystat(source_file, tmp)
+        tmp.chmod(mode)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
     os.replace(tmp, target_path)
+    LOG.debug("placed %s using %s", target_path, method)
+
+
+def _state_of(target_stat: os.stat_result) -> Optional[TargetState]:
+    if not stat.S_ISREG(target_stat.st_mode):
+        return None
+    return (
+        target_stat.st_size,
+        target_stat.st_mtime_ns,
+        target_stat.st_ino,
+        target_stat.st_ctime_ns,
+    )
+
+
+def _target_state(target_path: Path) -> Optional[TargetState]:
+    try:
+        return _state_of(target_path.lstat())
+    except OSError:
+        return None
+
+
+def _settled_state(target_path: Path, started_ns: int) -> Optional[TargetState]:
+    # a target modified within the racy window could change again without
+    # its mtime moving, so it is only recorded once it has been left alone
+    state = _target_state(target_path)
+    return None if is_racy(state, started_ns) else state
+
+
+def _known_target_hash(
+    prev: Optional[ManagedFile], state: Optional[TargetState]
+) -> Optional[str]:
+    if (
+        prev is not None
+        and prev.op == "place"
+        and prev.target_state is not None
+        and prev.target_state == state
+    ):
+        return prev.source_hash
+    return None
+
+
+def _target_hash(
+    prev: Optional[ManagedFile], target_path: Path, hashes: Hashes
+) -> str:
+    known = _known_target_hash(prev, _target_state(target_path))
+    return known if known is not None else _lookup_hash(hashes, target_path)
+
+
+def _cached_source_hash(
+    placement: _Placement, prev: Optional[ManagedFile]
+) -> Optional[str]:
+    if prev is not None and prev.source_path == str(placement.source_file):
+        return prev.source_hash
+    return None
+
+
+def _placement_hash_paths(
+    root: Path, placement: _Placement, prev: Optional[ManagedFile]
+) -> Iterator[Path]:
+    # only sizes are compared up front; a target is hashed only when it could
+    # still match its source and would otherwise be overwritten
+    try:
+        target_stat = (root / placement.target).lstat()
+    except OSError:
+        target_stat = None
+    if target_stat is not None and not placement.overwrite_changes:
+        return
+    if _cached_source_hash(placement, prev) is None:
+        yield placement.source_file
+    if target_stat is None:
+        return
+    state = _state_of(target_stat)
+    if (
+        state is not None
+        and target_stat.st_size == placement.source_file.stat().st_size
+        and _known_target_hash(prev, state) is None
+    ):
+        yield root / placement.target
 
 
 def _place_one(
-    steam_dir: Path, root: Path, placement: _Placement, prev: Optional[ManagedFile]
+    steam_dir: Path,
+    root: Path,
+    placement: _Placement,
+    prev: Optional[ManagedFile],
+    hashes: Hashes,
+    started_ns: int,
 ) -> Optional[ManagedFile]:
     target_path = root / placement.target
     is_symlink = target_path.is_symlink()
@@ -171,10 +360,9 @@ def _place_one(
         return prev
 
     source_path = str(placement.source_file)
-    if prev is not None and prev.source_path == source_path and prev.source_hash is not None:
-        source_hash = prev.source_hash
-    else:
-        source_hash = _hash_file(placement.source_file)
+    source_hash = _cached_source_hash(placement, prev)
+    if source_hash is None:
+        source_hash = _lookup_hash(hashes, placement.source_file)
     desired_mode = _resolve_mode(placement.executable, placement.source_file)
 
     had_backup = prev.had_backup if prev is not None else False
@@ -184,30 +372,28 @@ def _place_one(
         )
         had_backup = True
 
-    entry = ManagedFile(
-        app_id=placement.app_id,
-        location=placement.location,
-        target=placement.target,
-        op="place",
-        source_hash=source_hash,
-        had_backup=had_backup,
-        source_path=source_path,
-    )
-
     if (
         not is_symlink
         and target_path.is_file()
         and target_path.stat().st_size == placement.source_file.stat().st_size
-        and _hash_file(target_path) == source_hash
+        and _target_hash(prev, target_path, hashes) == source_hash
     ):
         if target_path.stat().st_mode & 0o777 != desired_mode:
             target_path.chmod(desired_mode)
-        return entry
-
-    target_path.parent.mkdir(parents=True, exist_ok=True)
-    _atomic_place(placement.source_file, target_path, desired_mode)
+    else:
+        target_path.parent.mkdir(parents=True, exist_ok=True)
+        _atomic_place(placement.source_file, target_path, desired_mode)
 
-    return entry
+    return ManagedFile(
+        app_id=placement.app_id,
+        location=placement.location,
+        target=placement.target,
+        op="place",
+        source_hash=source_hash,
+        had_backup=had_backup,
+        source_path=source_path,
+        target_state=_settled_state(target_path, started_ns),
+    )
 
 
 def _remove_targets(
@@ -285,7 +471,19 @@ def _cleanup_created_dirs(
     return survivors
 
 
-def _revert_one(steam_dir: Path, root: Optional[Path], entry: ManagedFile) -> None:
+def _revert_hash_path(root: Optional[Path], entry: ManagedFile) -> Optional[Path]:
+    if root is None or entry.op != "place" or entry.source_hash is None:
+        return None
+    target_path = root / entry.target
+    state = _target_state(target_path)
+    if state is None or _known_target_hash(entry, state) is not None:
+        return None
+    return target_path
+
+
+def _revert_one(
+    steam_dir: Path, root: Optional[Path], entry: ManagedFile, hashes: Hashes
+) -> None:
     stored = backup_path(steam_dir, entry.app_id, entry.location, entry.target)
 
     if root is None:
@@ -304,7 +502,7 @@ def _revert_one(steam_dir: Path, root: Optional[Path], entry: ManagedFile) -> No
         modified = (
             target_path.is_file()
             and entry.source_hash is not None
-            and _hash_file(target_path) != entry.source_hash
+            and _target_hash(entry, target_path, hashes) != entry.source_hash
         )
         if modified:
             LOG.info("leaving user-modified %s", target_path)
@@ -326,8 +524,12 @@ def _revert_one(steam_dir: Path, root: Optional[Path], entry: ManagedFile) -> No
 
 
 def apply_file_ops(
-    steam_dir: Path, file_ops: list[FileOp], remove_ops: list[RemoveOp]
+    steam_dir: Path,
+    file_ops: list[FileOp],
+    remove_ops: list[RemoveOp],
+    libraries: Optional[SteamLibraryIndex] = None,
 ) -> None:
+    started_ns = time.time_ns()
     prev_manifest = load_files_manifest(steam_dir)
     if (
         not file_ops
@@ -341,13 +543,16 @@ def apply_file_ops(
 
     root_cache: dict[tuple[int, str], Optional[Path]] = {}
 
+    if libraries is None:
+        libraries = SteamLibraryIndex(steam_dir)
+
     def root_for(app_id: int, location: str) -> Optional[Path]:
         cache_key = (app_id, location)
         if cache_key not in root_cache:
             root_cache[cache_key] = (
-                find_app_install_dir(steam_dir, app_id)
+                libraries.install_dir(app_id)
                 if location == "install"
-                else find_app_compat_prefix(steam_dir, app_id)
+                else libraries.compat_prefix(app_id)
             )
         return root_cache[cache_key]
 
@@ -358,6 +563,20 @@ def apply_file_ops(
     desired: set[FileKey] = set()
     created_dirs = {(d.app_id, d.location, d.target) for d in prev_manifest.dirs}
 
+    to_hash: set[Path] = set()
+    for key, placement in placements.items():
+        root = root_for(placement.app_id, placement.location)
+        if root is not None:
+            to_hash.update(_placement_hash_paths(root, placement, prev.get(key)))
+    hashes: Hashes = {}
+    if to_hash:
+        store_hashes = StoreHashCache(store_hashes_path(steam_dir))
+        known = store_hashes.lookup(to_hash)
+        hashes = _hash_files(to_hash - known.keys())
+        store_hashes.update(hashes)
+        store_hashes.save()
+        hashes.update(known)
+
     for key, placement in placements.items():
         desired.add(key)
         root = root_for(placement.app_id, placement.location)
@@ -373,7 +592,9 @@ def apply_file_ops(
             continue
         for rel in _dirs_to_create(root, placement.target):
             created_dirs.add((placement.app_id, placement.location, rel))
-        entry = _place_one(steam_dir, root, placement, prev.get(key))
+        entry = _place_one(
+            steam_dir, root, placement, prev.get(key), hashes, started_ns
+        )
         if entry is not None:
             new_files.append(entry)
 
@@ -415,10 +636,17 @@ def apply_file_ops(
         if base_is_dir:
             _cleanup_removed_dir(root, remove_op.target)
 
-    for key, entry in prev.items():
-        if key in desired:
-            continue
-        _revert_one(steam_dir, root_for(entry.app_id, entry.location), entry)
+    stale = [entry for key, entry in prev.items() if key not in desired]
+    to_hash = set()
+    for entry in stale:
+        path = _revert_hash_path(root_for(entry.app_id, entry.location), entry)
+        if path is not None:
+            to_hash.add(path)
+    revert_hashes = _hash_files(to_hash)
+    for entry in stale:
+        _revert_one(
+            steam_dir, root_for(entry.app_id, entry.location), entry, revert_hashes
+        )
 
     survivors = _cleanup_created_dirs(created_dirs, root_for)
 
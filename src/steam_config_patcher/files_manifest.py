@@ -3,7 +3,12 @@ from pathlib import Path
 from typing import Optional
 
 from steam_config_patcher.json_manifest import load_json_manifest, save_json_manifest
-from steam_config_patcher.types import FilesManifest, ManagedDir, ManagedFile
+from steam_config_patcher.types import (
+    FilesManifest,
+    ManagedDir,
+    ManagedFile,
+    TargetState,
+)
 
 LOG = logging.getLogger(__name__)
 
@@ -22,6 +27,15 @@ def backup_path(steam_dir: Path, app_id: int, location: str, target: str) -> Pat
     )
 
 
+def _parse_target_state(raw) -> Optional[TargetState]:
+    # only a cache, a bad entry just means that target gets hashed again
+    try:
+        size, mtime_ns, inode, ctime_ns = (int(value) for value in raw)
+    except (TypeError, ValueError):
+        return None
+    return size, mtime_ns, inode, ctime_ns
+
+
 def _parse(raw: dict) -> Optional[FilesManifest]:
     version = raw.get("version")
     if version != FILES_MANIFEST_VERSION:
@@ -37,6 +51,7 @@ def _parse(raw: dict) -> Optional[FilesManifest]:
                 source_hash=entry.get("source_hash"),
                 had_backup=bool(entry.get("had_backup", False)),
                 source_path=entry.get("source_path"),
+                target_state=_parse_target_state(entry.get("target_state")),
             )
             for entry in (raw.get("files") or [])
         ],
@@ -69,6 +84,7 @@ def save_files_manifest(steam_dir: Path, manifest: FilesManifest) -> None:
                     "source_hash": entry.source_hash,
                     "had_backup": entry.had_backup,
                     "source_path": entry.source_path,
+                    "target_state": entry.target_state,
                 }
                 for entry in manifest.files
             ],
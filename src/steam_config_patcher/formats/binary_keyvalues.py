@@ -1,11 +1,18 @@
-from copy import deepcopy
 from typing import Any, Optional
 
+from steam_config_patcher.fileio import FileWriter, file_state
 from steam_config_patcher.types import ConfigPatch, Deletion
-from steam_config_patcher.vdf.binary import dumps, loads
+from steam_config_patcher.vdf.binary import encode, loads
 
 
-def delete_key(destination: dict[Any, Any], deletion: Deletion) -> bool:
+ChangedPaths = set[tuple[str, ...]]
+
+
+def delete_key(
+    destination: dict[Any, Any],
+    deletion: Deletion,
+    changed: Optional[ChangedPaths] = None,
+) -> bool:
     *parent_path, leaf_key = deletion.key_path
 
     node = destination
@@ -18,41 +25,104 @@ def delete_key(destination: dict[Any, Any], deletion: Deletion) -> bool:
         return False
 
     del node[leaf_key]
+    if changed is not None:
+        changed.add(tuple(deletion.key_path))
     return True
 
 
-def recursive_update(destination: dict[Any, Any], source: dict[Any, Any]) -> bool:
+def _copy_dicts(value: Any) -> Any:
+    # leaves are immutable and can be shared with the patch, only dicts need
+    # copies of their own
+    if isinstance(value, dict):
+        return {key: _copy_dicts(item) for key, item in value.items()}
+    return value
+
+
+def recursive_update(
+    destination: dict[Any, Any],
+    source: dict[Any, Any],
+    changed: Optional[ChangedPaths] = None,
+    path: tuple[str, ...] = (),
+) -> bool:
+    # changed collects the key path of every value replaced or added
     modified = False
     for source_key, source_value in source.items():
         if source_key in destination:
             destination_value = destination[source_key]
             if isinstance(destination_value, dict) and isinstance(source_value, dict):
-                if recursive_update(destination_value, source_value):
-                    modified = True
-            else:
-                if destination_value != source_value:
-                    destination[source_key] = deepcopy(source_value)
+                if recursive_update(
+                    destination_value, source_value, changed, path + (source_key,)
+                ):
                     modified = True
-        else:
-            destination[source_key] = deepcopy(source_value)
-            modified = True
+                continue
+            if destination_value == source_value:
+                continue
+        destination[source_key] = _copy_dicts(source_value)
+        modified = True
+        if changed is not None:
+            changed.add(path + (source_key,))
     return modified
 
 
-def prepare_binary_keyvalues(config_patch: ConfigPatch) -> Optional[bytes]:
-    if config_patch.file_path.is_file():
-        kv = loads(config_patch.file_path.read_bytes())
+def replace_key(
+    destination: dict[Any, Any],
+    source: dict[Any, Any],
+    key_path: tuple[str, ...],
+    changed: Optional[ChangedPaths] = None,
+) -> bool:
+    *parent_path, leaf_key = key_path
+
+    value = source
+    for key in key_path:
+        if not isinstance(value, dict) or key not in value:
+            return False
+        value = value[key]
+
+    node = destination
+    for key in parent_path:
+        if not isinstance(node, dict) or key not in node:
+            return False
+        node = node[key]
+
+    if not isinstance(node, dict) or leaf_key not in node:
+        return False
+
+    # assigning over the existing key keeps its position in the parent
+    node[leaf_key] = _copy_dicts(value)
+    if changed is not None:
+        changed.add(tuple(key_path))
+    return True
+
+
+def prepare_binary_keyvalues(config_patch: ConfigPatch) -> Optional[FileWriter]:
+    if config_patch.parsed is not None and (
+        file_state(config_patch.file_path) == config_patch.parsed_state
+    ):
+        # the tree was handed over by the generate step, which is done with it
+        kv = config_patch.parsed
+    elif config_patch.file_path.is_file():
+        kv = loads(config_patch.file_path.read_bytes(), lossless=True)
     else:
         # no existing file, start fresh so new entries can be created
         kv: dict[Any, Any] = {}
 
-    modified = recursive_update(kv, config_patch.data)
+    changed: ChangedPaths = set()
+    modified = False
+    for key_path in config_patch.replaced:
+        if replace_key(kv, config_patch.data, key_path, changed):
+            modified = True
+
+    if recursive_update(kv, config_patch.data, changed):
+        modified = True
 
     for deletion in config_patch.deletions:
-        if delete_key(kv, deletion):
+        if delete_key(kv, deletion, changed):
             modified = True
 
     if not modified:
         return None
 
-    return dumps(kv)
+    # serialize now so encoding errors are reported while preparing; the
+    # buffer goes straight to the temp file without another copy
+    data = encode(kv, changed)
+    return lambda f: f.write(data)
@@ -1,12 +1,13 @@
-from typing import Iterator, Optional
+from typing import Iterable, Iterator, Optional
 
+from steam_config_patcher.fileio import FileWriter
 from steam_config_patcher.types import (
     ConfigPatch,
     Deletion,
     KeyValuesType,
     KeyValuesValue,
 )
-from steam_config_patcher.vdf.text import VdfNode, dumps, loads
+from steam_config_patcher.vdf.text import VdfNode, dump, loads
 
 KeyPath = tuple[*tuple[str, ...], str]
 
@@ -67,9 +68,8 @@ def guard_matches(node: VdfNode, deletion: Deletion) -> bool:
     return not target.is_block and target.value == deletion.expected
 
 
-def delete_key(kv: VdfNode, deletion: Deletion) -> bool:
-    *parent_path, leaf_name = deletion.key_path
-    parents = list(kv.find_all(*parent_path)) if parent_path else [kv]
+def delete_children(parents: Iterable[VdfNode], deletion: Deletion) -> bool:
+    leaf_name = deletion.key_path[-1]
 
     modified = False
     for parent in parents:
@@ -86,12 +86,119 @@ def delete_key(kv: VdfNode, deletion: Deletion) -> bool:
     return modified
 
 
-def prepare_keyvalues(config_patch: ConfigPatch) -> Optional[bytes]:
-    if not config_patch.file_path.is_file():
-        return None
+def delete_key(kv: VdfNode, deletion: Deletion) -> bool:
+    parent_path = deletion.key_path[:-1]
+    parents = list(kv.find_all(*parent_path)) if parent_path else [kv]
+    return delete_children(parents, deletion)
+
+
+class PatchTrie:
+    # one node per casefolded key path touched by a patch, so the whole patch
+    # can be merged into the tree in a single walk
+    __slots__ = ("name", "children", "values", "leaf_path", "has_writes", "deletions")
+
+    def __init__(self, name: Optional[str] = None):
+        # casing of the first patch key seen here, used when creating blocks
+        self.name = name
+        self.children: dict[str, PatchTrie] = {}
+        # values written to this path, in patch order
+        self.values: list[str] = []
+        self.leaf_path: Optional[KeyPath] = None
+        self.has_writes = False
+        # deletions of children of this path, in patch order
+        self.deletions: list[Deletion] = []
+
+    def child(self, name: str) -> "PatchTrie":
+        folded = name.casefold()
+        node = self.children.get(folded)
+        if node is None:
+            node = self.children[folded] = PatchTrie(name)
+        return node
+
+
+def build_patch_trie(config_patch: ConfigPatch) -> Optional[PatchTrie]:
+    root = PatchTrie()
+
+    for key_path, value in iterate_leaves(config_patch.data):
+        node = root
+        for name in key_path:
+            if node.values:
+                return None
+            node.has_writes = True
+            node = node.child(name)
+        if node.children:
+            return None
+        node.has_writes = True
+        if node.leaf_path is None:
+            node.leaf_path = key_path
+        node.values.append(str(value))
+
+    targets = set()
+    for deletion in config_patch.deletions:
+        node = root
+        for name in deletion.key_path[:-1]:
+            node = node.child(name)
+        node.deletions.append(deletion)
+        targets.add(tuple(name.casefold() for name in deletion.key_path))
+
+    # a deletion inside another deletion's target depends on patch order in
+    # ways a single walk can't reproduce
+    for target in targets:
+        if any(target[:i] in targets for i in range(1, len(target))):
+            return None
+
+    return root
+
+
+def children_named(blocks: list[VdfNode], name: str) -> list[VdfNode]:
+    return [node for block in blocks for node in block.find_all(name)]
+
+
+def apply_patch_trie(blocks: list[VdfNode], trie: PatchTrie, can_create: bool) -> bool:
+    modified = False
+
+    for child in trie.children.values():
+        matches = children_named(blocks, child.name)
+
+        if child.values:
+            if matches:
+                for value in child.values:
+                    for node in matches:
+                        if node.is_block:
+                            raise ValueError(
+                                "Refusing to overwrite non-leaf keyvalue block at "
+                                f"{child.leaf_path}"
+                            )
+                        if node.value != value:
+                            node.value = value
+                            modified = True
+            elif can_create:
+                for block in blocks:
+                    block.children.append(VdfNode(child.name, value=child.values[-1]))
+                modified = True
+            continue
+
+        sub_blocks = [node for node in matches if node.is_block]
+        if not sub_blocks and child.has_writes and can_create:
+            for block in blocks:
+                created = VdfNode(child.name, children=[])
+                block.children.append(created)
+                sub_blocks.append(created)
+            modified = True
 
-    kv = loads(config_patch.file_path.read_text(encoding="utf-8"))
+        if sub_blocks and apply_patch_trie(sub_blocks, child, can_create=True):
+            modified = True
+
+    # deletions run after every write below this path, matching the
+    # writes-then-deletions order of the sequential engine
+    for deletion in trie.deletions:
+        if delete_children(blocks, deletion):
+            modified = True
+
+    return modified
 
+
+def apply_sequentially(kv: VdfNode, config_patch: ConfigPatch) -> bool:
     modified = False
     for key_path, value in iterate_leaves(config_patch.data):
         if overwrite_key(kv, key_path, value):
@@ -101,7 +208,24 @@ def prepare_keyvalues(config_patch: ConfigPatch) -> Optional[bytes]:
         if delete_key(kv, deletion):
             modified = True
 
+    return modified
+
+
+def prepare_keyvalues(config_patch: ConfigPatch) -> Optional[FileWriter]:
+    if not config_patch.file_path.is_file():
+        return None
+
+    # lossless parsing lets the writer copy everything the patch left alone
+    kv = loads(config_patch.file_path.read_text(encoding="utf-8"), lossless=True)
+
+    trie = build_patch_trie(config_patch)
+    if trie is None:
+        modified = apply_sequentially(kv, config_patch)
+    else:
+        # top-level blocks are never created, only paths inside existing ones
+        modified = apply_patch_trie([kv], trie, can_create=False)
+
     if not modified:
         return None
 
-    return dumps(kv).encode("utf-8")
+    return lambda f: dump(kv, f)
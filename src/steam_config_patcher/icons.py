@@ -103,7 +103,9 @@ def apply_library_icons(steam_dir: Path, app_ids: set[int]) -> None:
     common: dict[int, dict] = {}
     appinfo_path = steam_dir.joinpath("appcache", "appinfo.vdf")
     try:
-        common = appinfo.load_common(appinfo_path.read_bytes(), app_ids=app_ids)
+        common = appinfo.load_common_file(
+            appinfo_path, app_ids, keys=appinfo.ICON_KEYS
+        )
     except FileNotFoundError:
         LOG.warning("appinfo.vdf not found, using fallback icons")
     except appinfo.AppInfoError as error:
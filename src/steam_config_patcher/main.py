@@ -1,6 +1,7 @@
 import argparse
 import logging
 from pathlib import Path
+from types import MappingProxyType
 from typing import Literal, Optional, Union
 
 from pydantic import BaseModel, ConfigDict, Field
@@ -77,6 +78,8 @@ class NonSteamAppSchema(AppSchema):
 
 class InputSchema(StrictSchema):
     onSteamRunning: Literal["wait", "close", "force-close", "skip"]
+    prepareJobs: int = Field(default=1, ge=1)
+    compactShortcuts: bool = False
     defaultCompatTool: CompatToolValue
     apps: dict[str, AppSchema]
     nonSteamApps: dict[str, NonSteamAppSchema]
@@ -107,8 +110,36 @@ def parse_input() -> PatcherConfig:
 
     steam_dir = get_steam_dir()
 
+    user_config = UserConfig(
+        launch_options=MappingProxyType(
+            {
+                app.id: app.launchOptions
+                for app in validated_input.apps.values()
+                if app.launchOptions
+            }
+        ),
+        non_steam_apps=MappingProxyType(
+            {
+                app.id: NonSteamAppConfig(
+                    name=app.name,
+                    target=app.target,
+                    start_in=app.startIn or "",
+                    icon=app.icon or "",
+                    launch_options=app.launchOptions or "",
+                    is_hidden=app.isHidden,
+                    allow_desktop_config=True,
+                    allow_overlay=app.allowOverlay,
+                    in_vr_library=app.inVrLibrary,
+                )
+                for app in validated_input.nonSteamApps.values()
+            }
+        ),
+    )
+
     return PatcherConfig(
         on_steam_running=validated_input.onSteamRunning,
+        prepare_jobs=validated_input.prepareJobs,
+        compact_shortcuts=validated_input.compactShortcuts,
         steam_dir=steam_dir,
         compat_tool_mapping={
             app.id: CompatToolConfig(
@@ -177,30 +208,8 @@ def parse_input() -> PatcherConfig:
             for app in validated_input.apps.values()
             for op in app.removeFiles
         ],
-        users={
-            user_id: UserConfig(
-                launch_options={
-                    app.id: app.launchOptions
-                    for app in validated_input.apps.values()
-                    if app.launchOptions
-                },
-                non_steam_apps={
-                    app.id: NonSteamAppConfig(
-                        name=app.name,
-                        target=app.target,
-                        start_in=app.startIn or "",
-                        icon=app.icon or "",
-                        launch_options=app.launchOptions or "",
-                        is_hidden=app.isHidden,
-                        allow_desktop_config=True,
-                        allow_overlay=app.allowOverlay,
-                        in_vr_library=app.inVrLibrary,
-                    )
-                    for app in validated_input.nonSteamApps.values()
-                },
-            )
-            for user_id in get_steam_user_ids(steam_dir)
-        },
+        # every user gets the same settings, so they share one read-only config
+        users=dict.fromkeys(get_steam_user_ids(steam_dir), user_config),
     )
 
 
@@ -8,6 +8,7 @@ from steam_config_patcher.types import (
     CONFIG_FILE,
     LOCALCONFIG_APPS_PATH,
     LOCALCONFIG_FILE,
+    FileFingerprint,
     ManagedKey,
     UserManifest,
 )
@@ -59,9 +60,26 @@ def _parse_v2(raw: dict) -> UserManifest:
         ],
         shortcuts=[int(x) for x in (raw.get("shortcuts") or [])],
         grid_art={str(k): str(v) for k, v in (raw.get("grid_art") or {}).items()},
+        fingerprints=_parse_fingerprints(raw.get("fingerprints") or {}),
     )
 
 
+def _parse_fingerprints(raw: dict) -> dict[str, FileFingerprint]:
+    fingerprints = {}
+    for path, entry in raw.items():
+        try:
+            fingerprints[path] = FileFingerprint(
+                size=int(entry["size"]),
+                mtime_ns=int(entry["mtime_ns"]),
+                digest=str(entry["digest"]),
+                patch_digest=str(entry["patch"]),
+            )
+        except (KeyError, TypeError, ValueError):
+            # only a cache, a bad entry just means that file gets parsed again
+            continue
+    return fingerprints
+
+
 def _parse(raw: dict) -> Optional[UserManifest]:
     version = raw.get("version")
     if version == 1:
@@ -95,5 +113,14 @@ def save_manifest(steam_dir: Path, user_id: int, manifest: UserManifest) -> None
             ],
             "shortcuts": manifest.shortcuts,
             "grid_art": manifest.grid_art,
+            "fingerprints": {
+                path: {
+                    "size": fingerprint.size,
+                    "mtime_ns": fingerprint.mtime_ns,
+                    "digest": fingerprint.digest,
+                    "patch": fingerprint.patch_digest,
+                }
+                for path, fingerprint in sorted(manifest.fingerprints.items())
+            },
         },
     )
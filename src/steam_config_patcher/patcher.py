@@ -1,7 +1,21 @@
+import hashlib
+import json
 import logging
-from typing import Iterable, Optional
-
-from steam_config_patcher.fileio import atomic_write_bytes
+import time
+from concurrent.futures import ThreadPoolExecutor
+from copy import deepcopy
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Iterable, Optional, Union
+
+from steam_config_patcher.fileio import (
+    FileState,
+    FileWriter,
+    atomic_write,
+    file_digest,
+    file_state,
+    is_racy,
+)
 from steam_config_patcher.files import apply_file_ops
 from steam_config_patcher.formats.binary_keyvalues import prepare_binary_keyvalues
 from steam_config_patcher.formats.keyvalues import prepare_keyvalues
@@ -9,8 +23,8 @@ from steam_config_patcher.grid import apply_grid_art, desired_grid_files
 from steam_config_patcher.icons import apply_library_icons
 from steam_config_patcher.manifest import load_manifest, save_manifest
 from steam_config_patcher.steam import (
+    SteamLibraryIndex,
     close_steam,
-    find_app_manifest,
     game_is_running,
     steam_is_running,
     wait_for_game_exit,
@@ -28,8 +42,10 @@ from steam_config_patcher.types import (
     LOCALCONFIG_FILE,
     ConfigPatch,
     Deletion,
+    FileFingerprint,
     KeyValuesType,
     ManagedKey,
+    NonSteamAppConfig,
     PatcherConfig,
     UserConfig,
     UserManifest,
@@ -72,6 +88,21 @@ def config_vdf_state(cfg: PatcherConfig) -> tuple[KeyValuesLeaves, list[ManagedK
     return leaves, managed_keys
 
 
+class ManagedKeyIndex:
+    # previous keys grouped by file once, so every step's cleanup is a lookup
+    # and a set difference instead of a scan over all keys
+    def __init__(self, keys: Iterable[ManagedKey]):
+        self.by_file: dict[str, dict[tuple[str, ...], ManagedKey]] = {}
+        for key in keys:
+            self.by_file.setdefault(key.file, {}).setdefault(key.key_path, key)
+
+    def for_file(self, file_id: str) -> dict[tuple[str, ...], ManagedKey]:
+        return self.by_file.get(file_id, {})
+
+
+PrevKeys = Union[Iterable[ManagedKey], ManagedKeyIndex]
+
+
 def appmanifest_file_id(app_id: int) -> str:
     return f"{APPMANIFEST_FILE_PREFIX}{app_id}"
 
@@ -121,12 +152,15 @@ def configured_appmanifest_ids(cfg: PatcherConfig) -> set[int]:
 
 
 def generate_appmanifest_patch(
-    cfg: PatcherConfig, app_id: int, prev_keys: Iterable[ManagedKey]
+    cfg: PatcherConfig,
+    app_id: int,
+    prev_keys: PrevKeys,
+    libraries: SteamLibraryIndex,
 ) -> Optional[ConfigPatch]:
     file_id = appmanifest_file_id(app_id)
     settings = appmanifest_settings(cfg, app_id)
 
-    file_path = find_app_manifest(cfg.steam_dir, app_id)
+    file_path = libraries.manifest(app_id)
     if file_path is None:
         if settings:
             LOG.warning(
@@ -178,22 +212,23 @@ def localconfig_vdf_state(
 
 
 def cleanup_deletions(
-    prev_keys: Iterable[ManagedKey],
+    prev_keys: PrevKeys,
     desired_keys: Iterable[ManagedKey],
     file_id: str,
 ) -> list[Deletion]:
-    desired_paths = {key.key_path for key in desired_keys if key.file == file_id}
+    if not isinstance(prev_keys, ManagedKeyIndex):
+        prev_keys = ManagedKeyIndex(prev_keys)
+    previous = prev_keys.for_file(file_id)
+    if not previous:
+        return []
 
-    removed: dict[tuple[str, ...], ManagedKey] = {}
-    for key in prev_keys:
-        if key.file == file_id and key.key_path not in desired_paths:
-            removed.setdefault(key.key_path, key)
-
-    return [removed[key_path].to_deletion() for key_path in sorted(removed)]
+    desired_paths = {key.key_path for key in desired_keys if key.file == file_id}
+    removed = previous.keys() - desired_paths
+    return [previous[key_path].to_deletion() for key_path in sorted(removed)]
 
 
 def generate_config_vdf_patch(
-    cfg: PatcherConfig, prev_keys: Iterable[ManagedKey]
+    cfg: PatcherConfig, prev_keys: PrevKeys
 ) -> ConfigPatch:
     leaves, desired_keys = config_vdf_state(cfg)
 
@@ -229,6 +264,71 @@ def quote_path(path: str) -> str:
     return f'"{path}"' if path else path
 
 
+def shortcut_entry(app_id: int, app: NonSteamAppConfig) -> KeyValuesType:
+    return {
+        "appid": app_id,
+        "AppName": app.name,
+        "Exe": quote_path(app.target),
+        "StartDir": quote_path(app.start_in),
+        "icon": app.icon,
+        "LaunchOptions": app.launch_options,
+        "IsHidden": 1 if app.is_hidden else 0,
+        "AllowDesktopConfig": 1 if app.allow_desktop_config else 0,
+        "OpenVR": 1 if app.in_vr_library else 0,
+        "tags": {},
+    }
+
+
+def merged_shortcut(shortcut: KeyValuesType, entry: KeyValuesType) -> KeyValuesType:
+    merged = deepcopy(shortcut)
+    for key, value in entry.items():
+        if isinstance(merged.get(key), dict) and isinstance(value, dict):
+            merged[key].update(value)
+        else:
+            merged[key] = value
+    return merged
+
+
+def compact_shortcuts(
+    shortcuts: KeyValuesType,
+    entries: dict[int, KeyValuesType],
+    index_by_app_id: dict[int, str],
+    removed_indices: set[str],
+) -> tuple[KeyValuesType, list[tuple[str, ...]]]:
+    # renumber the surviving shortcuts 0..n-1 in their current order, new ones
+    # after them
+    ours = {
+        index: app_id for app_id, index in index_by_app_id.items() if app_id in entries
+    }
+    slots: list[tuple[Optional[str], Optional[int]]] = [
+        (index, ours.get(index))
+        for index in sorted(shortcuts, key=int)
+        if index not in removed_indices
+    ]
+    slots += [(None, app_id) for app_id in entries if app_id not in index_by_app_id]
+
+    if not removed_indices and list(shortcuts) == [
+        str(index) for index in range(len(shortcuts))
+    ]:
+        # already dense and in order, new shortcuts merge in after the rest
+        data = {
+            str(new_index): entries[app_id]
+            for new_index, (_, app_id) in enumerate(slots)
+            if app_id is not None
+        }
+        return {"shortcuts": data}, []
+
+    # merging can't move keys, so the whole dict is written out in the new order
+    data = {}
+    for new_index, (old_index, app_id) in enumerate(slots):
+        entry = entries[app_id] if app_id is not None else {}
+        if old_index is None:
+            data[str(new_index)] = entry
+        else:
+            data[str(new_index)] = merged_shortcut(shortcuts[old_index], entry)
+    return {"shortcuts": data}, [("shortcuts",)]
+
+
 def generate_shortcuts_vdf_patch(
     cfg: PatcherConfig,
     user_id: int,
@@ -251,61 +351,76 @@ def generate_shortcuts_vdf_patch(
 
     # steam only creates shortcuts.vdf once a shortcut exists, so start fresh
     # when it's missing to allow adding the first non steam app
-    kv = binary.loads(file_path.read_bytes()) if file_exists else {}
-
-    # hacky way to see which index we should use based on app id and existing shortcuts
+    state = file_state(file_path)
+    kv = binary.loads(file_path.read_bytes(), lossless=True) if file_exists else {}
     shortcuts = kv.get("shortcuts") or {}
-    keys = [int(k) for k in shortcuts.keys()]
-    max_index = max(keys) if keys else -1
-    index_mapping: dict[int, int] = {}
-    index_offset = 1
-
-    for app_id in user_config.non_steam_apps.keys():
-        # set index by matching app id
-        for shortcut_index, shortcut in shortcuts.items():
-            if shortcut.get("appid") == app_id:
-                index_mapping[app_id] = shortcut_index
-                break
-
-        # if no matching app id, use next available index
-        if app_id not in index_mapping:
-            index_mapping[app_id] = max_index + index_offset
-            index_offset += 1
 
     # remove shortcuts we previously created for non-steam apps that are no longer configured
     # matched by our generated app id, which is unique to us
     removed_app_ids = set(prev_manifest.shortcuts) - set(user_config.non_steam_apps)
-    deletions = [
-        Deletion(key_path=("shortcuts", str(shortcut_index)))
-        for shortcut_index, shortcut in shortcuts.items()
-        if shortcut.get("appid") in removed_app_ids
-    ]
+
+    # one pass over the existing shortcuts: the lowest index holding each app id,
+    # the ones to remove, and the highest index in use
+    index_by_app_id: dict[int, str] = {}
+    removed_indices: set[str] = set()
+    max_index = -1
+    for shortcut_index, shortcut in shortcuts.items():
+        max_index = max(max_index, int(shortcut_index))
+        app_id = shortcut.get("appid")
+        current = index_by_app_id.get(app_id)
+        if current is None or int(shortcut_index) < int(current):
+            index_by_app_id[app_id] = shortcut_index
+        if app_id in removed_app_ids:
+            removed_indices.add(shortcut_index)
+
+    entries = {
+        app_id: shortcut_entry(app_id, app)
+        for app_id, app in user_config.non_steam_apps.items()
+    }
+
+    if cfg.compact_shortcuts:
+        data, replaced = compact_shortcuts(
+            shortcuts, entries, index_by_app_id, removed_indices
+        )
+        return ConfigPatch(
+            file_path=file_path,
+            file_format="binary-keyvalues",
+            data=data,
+            replaced=replaced,
+            parsed=kv,
+            parsed_state=state,
+        )
+
+    # configured apps keep the index already holding their app id, new ones
+    # take the next free index
+    index_mapping: dict[int, str] = {}
+    next_index = max_index + 1
+    for app_id in entries:
+        if app_id in index_by_app_id:
+            index_mapping[app_id] = index_by_app_id[app_id]
+        else:
+            index_mapping[app_id] = str(next_index)
+            next_index += 1
 
     return ConfigPatch(
         file_path=file_path,
         file_format="binary-keyvalues",
         data={
             "shortcuts": {
-                str(index_mapping[app_id]): {
-                    "appid": app_id,
-                    "AppName": app.name,
-                    "Exe": quote_path(app.target),
-                    "StartDir": quote_path(app.start_in),
-                    "icon": app.icon,
-                    "LaunchOptions": app.launch_options,
-                    "IsHidden": 1 if app.is_hidden else 0,
-                    "AllowDesktopConfig": 1 if app.allow_desktop_config else 0,
-                    "OpenVR": 1 if app.in_vr_library else 0,
-                    "tags": {},
-                }
-                for app_id, app in user_config.non_steam_apps.items()
+                index_mapping[app_id]: entry for app_id, entry in entries.items()
             }
         },
-        deletions=deletions,
+        deletions=[
+            Deletion(key_path=("shortcuts", shortcut_index))
+            for shortcut_index in shortcuts
+            if shortcut_index in removed_indices
+        ],
+        parsed=kv,
+        parsed_state=state,
     )
 
 
-def prepare_patch(config_patch: ConfigPatch) -> Optional[bytes]:
+def prepare_patch(config_patch: ConfigPatch) -> Optional[FileWriter]:
     match config_patch.file_format:
         case "keyvalues":
             return prepare_keyvalues(config_patch)
@@ -314,42 +429,120 @@ def prepare_patch(config_patch: ConfigPatch) -> Optional[bytes]:
     return None
 
 
-def desired_manifest(cfg: PatcherConfig, user_config: UserConfig) -> UserManifest:
+def global_managed_keys(cfg: PatcherConfig) -> list[ManagedKey]:
     _, config_keys = config_vdf_state(cfg)
+    return config_keys + game_appmanifest_keys(cfg)
+
+
+def desired_manifest(
+    cfg: PatcherConfig,
+    user_config: UserConfig,
+    global_keys: Optional[list[ManagedKey]] = None,
+) -> UserManifest:
+    if global_keys is None:
+        global_keys = global_managed_keys(cfg)
     _, localconfig_keys = localconfig_vdf_state(user_config)
 
     return UserManifest(
-        managed_keys=config_keys + game_appmanifest_keys(cfg) + localconfig_keys,
+        managed_keys=global_keys + localconfig_keys,
         shortcuts=list(user_config.non_steam_apps.keys()),
     )
 
 
+def _digestable(value):
+    # keeps value types apart, binary keyvalues writes 1 and Uint64(1) differently
+    if isinstance(value, dict):
+        return [[key, _digestable(item)] for key, item in value.items()]
+    return [type(value).__name__, value]
+
+
+def patch_digest(config_patch: ConfigPatch) -> str:
+    payload = json.dumps(
+        [
+            config_patch.file_format,
+            _digestable(config_patch.data),
+            [asdict(deletion) for deletion in config_patch.deletions],
+            [list(path) for path in config_patch.replaced],
+        ]
+    )
+    return hashlib.blake2b(payload.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def fingerprint_file(path: Path, patch_digest: str) -> Optional[FileFingerprint]:
+    state = file_state(path)
+    if state is None:
+        return None
+    digest = file_digest(path)
+    # changed while hashing, the digest can't be trusted
+    if file_state(path) != state:
+        return None
+    size, mtime_ns, _inode = state
+    return FileFingerprint(size, mtime_ns, digest, patch_digest)
+
+
+def is_fresh(
+    fingerprint: Optional[FileFingerprint], path: Path, patch_digest: str
+) -> bool:
+    # the file still holds exactly what the same patch left it as last run
+    if fingerprint is None or fingerprint.patch_digest != patch_digest:
+        return False
+    state = file_state(path)
+    if state is None or state[:2] != (fingerprint.size, fingerprint.mtime_ns):
+        return False
+    return fingerprint_file(path, patch_digest) == fingerprint
+
+
+@dataclass
+class _PreparedStep:
+    description: str
+    file_path: Optional[Path] = None
+    write: Optional[FileWriter] = None
+    state: FileState = None
+    # the file wasn't modified while this step was reading it
+    settled: bool = False
+    failed: bool = False
+    patch_digest: Optional[str] = None
+    # set when the file was skipped because it already matched its patch
+    fingerprint: Optional[FileFingerprint] = None
+    written: bool = False
+
+    def unchanged(self) -> bool:
+        return (
+            self.settled
+            and self.file_path is not None
+            and file_state(self.file_path) == self.state
+        )
+
+
 def patch_config_files(cfg: PatcherConfig):
     prev_manifests = {
         user_id: load_manifest(cfg.steam_dir, user_id) for user_id in cfg.users
     }
 
     # config.vdf is global so cleanup considers keys managed for any user
-    all_prev_keys = [
+    all_prev_keys = ManagedKeyIndex(
         key for manifest in prev_manifests.values() for key in manifest.managed_keys
-    ]
+    )
 
     appmanifest_app_ids = sorted(
         configured_appmanifest_ids(cfg)
         | {
             app_id
-            for key in all_prev_keys
-            if (app_id := appmanifest_app_id(key.file)) is not None
+            for file_id in all_prev_keys.by_file
+            if (app_id := appmanifest_app_id(file_id)) is not None
         }
     )
 
+    # one scan of every library serves all manifest and file-op lookups
+    libraries = SteamLibraryIndex(cfg.steam_dir)
+
     patch_steps = [
         ("config.vdf", lambda: generate_config_vdf_patch(cfg, all_prev_keys)),
         *[
             (
                 f"appmanifest_{app_id}.acf",
                 lambda app_id=app_id: generate_appmanifest_patch(
-                    cfg, app_id, all_prev_keys
+                    cfg, app_id, all_prev_keys, libraries
                 ),
             )
             for app_id in appmanifest_app_ids
@@ -376,21 +569,72 @@ def patch_config_files(cfg: PatcherConfig):
 
     failed: set[str] = set()
 
-    def prepare_all():
-        prepared = []
-        for description, generate in patch_steps:
-            try:
-                config_patch = generate()
-                data = None if config_patch is None else prepare_patch(config_patch)
-            except Exception:
-                failed.add(description)
-                LOG.exception("failed to prepare %s", description)
-                continue
-            if data is not None:
-                prepared.append((description, config_patch.file_path, data))
-        return prepared
-
-    prepared = prepare_all()
+    results: dict[str, _PreparedStep] = {}
+
+    # config.vdf and appmanifests are shared, any user's record of them will do
+    recorded: dict[str, FileFingerprint] = {}
+    for manifest in prev_manifests.values():
+        for path, fingerprint in manifest.fingerprints.items():
+            recorded.setdefault(path, fingerprint)
+
+    def prepare_step(description, generate) -> _PreparedStep:
+        started_ns = time.time_ns()
+        fingerprint = None
+        try:
+            config_patch = generate()
+            if config_patch is None:
+                return _PreparedStep(description)
+            digest = patch_digest(config_patch)
+            file_path = config_patch.file_path
+            if is_fresh(recorded.get(str(file_path)), file_path, digest):
+                fingerprint = recorded[str(file_path)]
+                write = None
+            else:
+                write = prepare_patch(config_patch)
+        except Exception:
+            LOG.exception("failed to prepare %s", description)
+            return _PreparedStep(description, failed=True)
+
+        state = file_state(file_path)
+        return _PreparedStep(
+            description,
+            file_path=file_path,
+            write=write,
+            state=state,
+            settled=not is_racy(state, started_ns),
+            patch_digest=digest,
+            fingerprint=fingerprint,
+        )
+
+    def prepare_all(steps):
+        # steps touch separate files, so they can be read and parsed side by
+        # side; results keep step order so writes stay deterministic
+        if cfg.prepare_jobs > 1 and len(steps) > 1:
+            with ThreadPoolExecutor(max_workers=cfg.prepare_jobs) as pool:
+                done = list(pool.map(lambda step: prepare_step(*step), steps))
+        else:
+            done = [prepare_step(*step) for step in steps]
+
+        for step in done:
+            results[step.description] = step
+            if step.failed:
+                failed.add(step.description)
+            else:
+                failed.discard(step.description)
+
+        return [
+            step
+            for description, _generate in patch_steps
+            if (step := results[description]).write is not None
+        ]
+
+    def prepare_changed():
+        # only steps whose file steam touched while shutting down are redone
+        return prepare_all(
+            [step for step in patch_steps if not results[step[0]].unchanged()]
+        )
+
+    prepared = prepare_all(patch_steps)
     has_file_ops = bool(cfg.file_ops or cfg.remove_ops)
 
     blocked = False
@@ -400,7 +644,7 @@ def patch_config_files(cfg: PatcherConfig):
         elif cfg.on_steam_running == "wait":
             LOG.info("steam is running, waiting for it to exit")
             wait_for_steam_exit()
-            prepared = prepare_all()
+            prepared = prepare_changed()
         else:
             if cfg.on_steam_running == "close" and game_is_running():
                 LOG.info(
@@ -408,15 +652,16 @@ def patch_config_files(cfg: PatcherConfig):
                 )
                 wait_for_game_exit()
             close_steam()
-            prepared = prepare_all()
+            prepared = prepare_changed()
 
     if not blocked:
-        for description, file_path, data in prepared:
+        for step in prepared:
             try:
-                atomic_write_bytes(file_path, data)
+                atomic_write(step.file_path, step.write)
+                step.written = True
             except Exception:
-                failed.add(description)
-                LOG.exception("failed to write %s", description)
+                failed.add(step.description)
+                LOG.exception("failed to write %s", step.description)
 
     skip_files = False
     if has_file_ops and game_is_running():
@@ -437,7 +682,7 @@ def patch_config_files(cfg: PatcherConfig):
         )
     else:
         try:
-            apply_file_ops(cfg.steam_dir, cfg.file_ops, cfg.remove_ops)
+            apply_file_ops(cfg.steam_dir, cfg.file_ops, cfg.remove_ops, libraries)
         except Exception:
             LOG.exception("failed to apply file operations")
 
@@ -456,10 +701,23 @@ def patch_config_files(cfg: PatcherConfig):
     except Exception:
         LOG.exception("failed to apply library icons")
 
+    fingerprints = {}
+    for step in results.values():
+        if step.patch_digest is None or not (step.written or step.unchanged()):
+            continue
+        fingerprint = step.fingerprint or fingerprint_file(
+            step.file_path, step.patch_digest
+        )
+        if fingerprint is not None:
+            fingerprints[str(step.file_path)] = fingerprint
+
     desired_grid = desired_grid_files(cfg.grid_art)
+    # config.vdf and appmanifest keys are the same in every user's manifest
+    global_keys = global_managed_keys(cfg)
     for user_id, user in cfg.users.items():
         try:
-            manifest = desired_manifest(cfg, user)
+            manifest = desired_manifest(cfg, user, global_keys)
+            manifest.fingerprints = fingerprints
             manifest.grid_art = apply_grid_art(
                 cfg.steam_dir, user_id, desired_grid, prev_manifests[user_id].grid_art
             )
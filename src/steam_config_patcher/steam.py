@@ -1,6 +1,7 @@
 import os
 import shutil
 import subprocess
+import threading
 import time
 from pathlib import Path
 from typing import Optional
@@ -35,8 +36,9 @@ def get_steam_user_ids(steam_dir: Path) -> list[int]:
     ]
 
 
-def steam_library_paths(steam_dir: Path) -> list[Path]:
-    paths = [steam_dir]
+def _read_library_folders(steam_dir: Path) -> list[tuple[Path, list[int]]]:
+    # each library with the app ids its "apps" block says it holds
+    folders_found = [(steam_dir, [])]
 
     for relative in (("config", "libraryfolders.vdf"), ("steamapps", "libraryfolders.vdf")):
         vdf_file = steam_dir.joinpath(*relative)
@@ -50,28 +52,121 @@ def steam_library_paths(steam_dir: Path) -> list[Path]:
                     continue
                 path_node = folder.find("path")
                 if path_node is not None and not path_node.is_block:
-                    paths.append(Path(path_node.value))
+                    apps = folder.find("apps")
+                    app_ids = [
+                        int(app.name)
+                        for app in (apps.children if apps is not None else None) or []
+                        if app.name.isdigit()
+                    ]
+                    folders_found.append((Path(path_node.value), app_ids))
         break
 
-    seen = set()
+    seen: dict[str, list[int]] = {}
     unique = []
-    for path in paths:
+    for path, app_ids in folders_found:
         if str(path) not in seen:
-            seen.add(str(path))
-            unique.append(path)
+            seen[str(path)] = app_ids
+            unique.append((path, app_ids))
+        else:
+            seen[str(path)].extend(app_ids)
     return unique
 
 
-def find_app_manifest(steam_dir: Path, app_id: int) -> Optional[Path]:
-    for library in steam_library_paths(steam_dir):
-        manifest = library.joinpath("steamapps", f"appmanifest_{app_id}.acf")
-        if manifest.is_file():
-            return manifest
-    return None
+def steam_library_paths(steam_dir: Path) -> list[Path]:
+    return [path for path, _app_ids in _read_library_folders(steam_dir)]
+
+
+class SteamLibraryIndex:
+    # answers app id lookups for a whole run. libraryfolders.vdf is parsed
+    # once and its "apps" blocks say which library to look in; the steamapps
+    # dirs are only listed, once, when an app isn't where those blocks say
+    def __init__(self, steam_dir: Path):
+        self.steam_dir = steam_dir
+        self._folders: Optional[list[tuple[Path, list[int]]]] = None
+        self._listed: Optional[dict[int, Path]] = None
+        self._scanned: Optional[dict[int, Path]] = None
+        self._manifests: dict[int, Optional[Path]] = {}
+        self._install_dirs: dict[int, Optional[Path]] = {}
+        # patch steps may be prepared from several threads at once
+        self._lock = threading.RLock()
+
+    def _library_folders(self) -> list[tuple[Path, list[int]]]:
+        with self._lock:
+            if self._folders is None:
+                self._folders = _read_library_folders(self.steam_dir)
+        return self._folders
+
+    @property
+    def libraries(self) -> list[Path]:
+        return [path for path, _app_ids in self._library_folders()]
+
+    def _listed_libraries(self) -> dict[int, Path]:
+        with self._lock:
+            if self._listed is None:
+                listed: dict[int, Path] = {}
+                for library, app_ids in self._library_folders():
+                    for app_id in app_ids:
+                        listed.setdefault(app_id, library)
+                self._listed = listed
+        return self._listed
+
+    def _scanned_manifests(self) -> dict[int, Path]:
+        with self._lock:
+            if self._scanned is None:
+                self._scanned = self._scan_manifests()
+        return self._scanned
+
+    def _scan_manifests(self) -> dict[int, Path]:
+        manifests: dict[int, Path] = {}
+        for library in self.libraries:
+            try:
+                entries = list(os.scandir(library / "steamapps"))
+            except OSError:
+                continue
+            for entry in entries:
+                app_id = _appmanifest_id(entry.name)
+                if app_id is None or app_id in manifests:
+                    # earlier libraries win, like probing them in order
+                    continue
+                if entry.is_file():
+                    manifests[app_id] = Path(entry.path)
+        return manifests
+
+    def manifest(self, app_id: int) -> Optional[Path]:
+        if app_id not in self._manifests:
+            self._manifests[app_id] = self._find_manifest(app_id)
+        return self._manifests[app_id]
+
+    def _find_manifest(self, app_id: int) -> Optional[Path]:
+        library = self._listed_libraries().get(app_id)
+        if library is not None:
+            manifest = library.joinpath("steamapps", f"appmanifest_{app_id}.acf")
+            if manifest.is_file():
+                return manifest
+        return self._scanned_manifests().get(app_id)
+
+    def install_dir(self, app_id: int) -> Optional[Path]:
+        if app_id not in self._install_dirs:
+            self._install_dirs[app_id] = _read_install_dir(self.manifest(app_id))
+        return self._install_dirs[app_id]
+
+    def compat_prefix(self, app_id: int) -> Optional[Path]:
+        manifest = self.manifest(app_id)
+        if manifest is None:
+            return None
+
+        prefix = manifest.parent.joinpath("compatdata", str(app_id), "pfx")
+        return prefix if prefix.is_dir() else None
+
+
+def _appmanifest_id(name: str) -> Optional[int]:
+    if not (name.startswith("appmanifest_") and name.endswith(".acf")):
+        return None
+    app_id = name[len("appmanifest_") : -len(".acf")]
+    return int(app_id) if app_id.isdigit() else None
 
 
-def find_app_install_dir(steam_dir: Path, app_id: int) -> Optional[Path]:
-    manifest = find_app_manifest(steam_dir, app_id)
+def _read_install_dir(manifest: Optional[Path]) -> Optional[Path]:
     if manifest is None:
         return None
 
@@ -84,15 +179,6 @@ def find_app_install_dir(steam_dir: Path, app_id: int) -> Optional[Path]:
     return install_dir if install_dir.is_dir() else None
 
 
-def find_app_compat_prefix(steam_dir: Path, app_id: int) -> Optional[Path]:
-    manifest = find_app_manifest(steam_dir, app_id)
-    if manifest is None:
-        return None
-
-    prefix = manifest.parent.joinpath("compatdata", str(app_id), "pfx")
-    return prefix if prefix.is_dir() else None
-
-
 def steam_processes() -> list[psutil.Process]:
     uid = os.getuid()
     processes = []
@@ -0,0 +1,124 @@
+import logging
+import os
+import struct
+from pathlib import Path
+from typing import Iterable, Optional
+
+from steam_config_patcher.fileio import atomic_write_bytes
+
+LOG = logging.getLogger(__name__)
+
+STORE_DIR = "/nix/store"
+
+STORE_HASHES_NAME = "steam-config-nix-store-hashes.bin"
+STORE_HASHES_MAGIC = b"SCNH"
+STORE_HASHES_VERSION = 1
+
+# magic, version
+_HEADER = struct.Struct("<4sI")
+# path length, size, inode, sha256 digest; the utf-8 path follows
+_ENTRY = struct.Struct("<IQQ32s")
+
+# path -> (size, inode, digest)
+Entries = dict[str, tuple[int, int, bytes]]
+
+
+def store_hashes_path(steam_dir: Path) -> Path:
+    return steam_dir.joinpath("config", STORE_HASHES_NAME)
+
+
+def _is_store_path(real_path: str) -> bool:
+    return real_path.startswith(STORE_DIR.rstrip("/") + "/")
+
+
+def _load(path: Path) -> Entries:
+    try:
+        raw = path.read_bytes()
+    except FileNotFoundError:
+        return {}
+    except OSError:
+        LOG.debug("could not read nix store hash cache", exc_info=True)
+        return {}
+
+    entries: Entries = {}
+    try:
+        magic, version = _HEADER.unpack_from(raw, 0)
+        if (magic, version) != (STORE_HASHES_MAGIC, STORE_HASHES_VERSION):
+            return {}
+        offset = _HEADER.size
+        while offset < len(raw):
+            length, size, inode, digest = _ENTRY.unpack_from(raw, offset)
+            offset += _ENTRY.size
+            if offset + length > len(raw):
+                return {}
+            entries[raw[offset : offset + length].decode("utf-8")] = (
+                size,
+                inode,
+                digest,
+            )
+            offset += length
+    except (struct.error, UnicodeDecodeError):
+        return {}
+    return entries
+
+
+class StoreHashCache:
+    # store paths are immutable, so a source hashed once keeps its hash. entries
+    # are keyed by the resolved store path, never by a link into the store that
+    # could be repointed; the size and inode guard against a path being
+    # collected and built again
+    def __init__(self, path: Path):
+        self.path = path
+        self.entries = _load(path)
+        self.dirty = False
+
+    def get(self, path: Path) -> Optional[str]:
+        real_path = os.path.realpath(path)
+        entry = self.entries.get(real_path)
+        if entry is None:
+            return None
+        try:
+            stat = os.stat(real_path)
+        except OSError:
+            return None
+        if (stat.st_size, stat.st_ino) != entry[:2]:
+            return None
+        return entry[2].hex()
+
+    def lookup(self, paths: Iterable[Path]) -> dict[Path, str]:
+        found = {}
+        for path in paths:
+            digest = self.get(path)
+            if digest is not None:
+                found[path] = digest
+        return found
+
+    def update(self, hashes: dict[Path, str]) -> None:
+        for path, digest in hashes.items():
+            real_path = os.path.realpath(path)
+            if not _is_store_path(real_path):
+                continue
+            try:
+                stat = os.stat(real_path)
+            except OSError:
+                continue
+            self.entries[real_path] = (stat.st_size, stat.st_ino, bytes.fromhex(digest))
+            self.dirty = True
+
+    def save(self) -> None:
+        if not self.dirty or not self.path.parent.is_dir():
+            return
+        # paths the store has since collected are dropped
+        chunks = [_HEADER.pack(STORE_HASHES_MAGIC, STORE_HASHES_VERSION)]
+        for name, (size, inode, digest) in sorted(self.entries.items()):
+            if not os.path.lexists(name):
+                continue
+            encoded = name.encode("utf-8")
+            chunks.append(_ENTRY.pack(len(encoded), size, inode, digest))
+            chunks.append(encoded)
+        try:
+            atomic_write_bytes(self.path, b"".join(chunks))
+        except OSError:
+            LOG.debug("could not save nix store hash cache", exc_info=True)
+            return
+        self.dirty = False
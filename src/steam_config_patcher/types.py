@@ -1,6 +1,9 @@
+import sys
 from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Literal, Optional, Union
+from typing import Literal, Mapping, Optional, Union
+
+from steam_config_patcher.fileio import FileState
 
 CONFIG_FILE = "config"
 LOCALCONFIG_FILE = "localconfig"
@@ -21,8 +24,30 @@ COMPAT_TOOL_MAPPING_PATH = (
 )
 LOCALCONFIG_APPS_PATH = ("UserLocalConfigStore", "Software", "Valve", "Steam", "Apps")
 
+_KEY_PATHS: dict[tuple[str, ...], tuple[str, ...]] = {}
 
-@dataclass
+
+# manifests repeat the same handful of file names, locations and key path
+# prefixes across thousands of entries, so entries share one copy of each
+def intern_path(path: tuple[str, ...]) -> tuple[str, ...]:
+    interned = _KEY_PATHS.get(path)
+    if interned is None:
+        interned = tuple(sys.intern(part) for part in path)
+        _KEY_PATHS[interned] = interned
+    return interned
+
+
+def _intern_fields(obj, *names: str) -> None:
+    for name in names:
+        value = getattr(obj, name)
+        object.__setattr__(
+            obj,
+            name,
+            sys.intern(value) if isinstance(value, str) else intern_path(tuple(value)),
+        )
+
+
+@dataclass(frozen=True, slots=True)
 class NonSteamAppConfig:
     name: str
     target: str
@@ -43,7 +68,7 @@ GRID_SLOTS = (
 )
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class GridArt:
     cover: Optional[str] = None
     header: Optional[str] = None
@@ -51,13 +76,13 @@ class GridArt:
     logo: Optional[str] = None
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class UserConfig:
-    launch_options: dict[int, str]
-    non_steam_apps: dict[int, NonSteamAppConfig]
+    launch_options: Mapping[int, str]
+    non_steam_apps: Mapping[int, NonSteamAppConfig]
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class CompatToolConfig:
     name: str
     priority: int
@@ -76,26 +101,34 @@ class PatcherConfig:
     library_icon_apps: set[int] = field(default_factory=set)
     file_ops: list["FileOp"] = field(default_factory=list)
     remove_ops: list["RemoveOp"] = field(default_factory=list)
+    prepare_jobs: int = 1
+    compact_shortcuts: bool = False
 
 
 KeyValuesValue = str | int
 KeyValuesType = dict[str, Union[KeyValuesValue, "KeyValuesType"]]
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class Deletion:
     key_path: tuple[str, ...]
     guard_path: tuple[str, ...] = ()
     expected: Optional[str] = None
 
+    def __post_init__(self):
+        _intern_fields(self, "key_path", "guard_path")
+
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class ManagedKey:
     file: str
     key_path: tuple[str, ...]
     guard_path: tuple[str, ...] = ()
     expected: Optional[str] = None
 
+    def __post_init__(self):
+        _intern_fields(self, "file", "key_path", "guard_path")
+
     def to_deletion(self) -> Deletion:
         return Deletion(
             key_path=self.key_path,
@@ -110,6 +143,21 @@ class ConfigPatch:
     file_format: Literal["keyvalues", "binary-keyvalues"]
     data: KeyValuesType
     deletions: list[Deletion] = field(default_factory=list)
+    # key paths whose dict in data replaces the existing one, in data's key
+    # order, instead of being merged into it
+    replaced: list[tuple[str, ...]] = field(default_factory=list)
+    # the file as generating the patch already parsed it, with its state at
+    # the time; preparing reuses it while the file still has that state
+    parsed: Optional[KeyValuesType] = field(default=None, compare=False, repr=False)
+    parsed_state: FileState = field(default=None, compare=False, repr=False)
+
+
+@dataclass(frozen=True, slots=True)
+class FileFingerprint:
+    size: int
+    mtime_ns: int
+    digest: str
+    patch_digest: str
 
 
 @dataclass
@@ -117,12 +165,20 @@ class UserManifest:
     managed_keys: list[ManagedKey] = field(default_factory=list)
     shortcuts: list[int] = field(default_factory=list)
     grid_art: dict[str, str] = field(default_factory=dict)
+    # a cache of target files known to already satisfy their patch, keyed by
+    # path; not part of what the manifest manages
+    fingerprints: dict[str, FileFingerprint] = field(
+        default_factory=dict, compare=False
+    )
 
 
 FileLocation = Literal["install", "prefix"]
 
+# (size, mtime_ns, inode, ctime_ns) of a placed target
+TargetState = tuple[int, int, int, int]
 
-@dataclass
+
+@dataclass(frozen=True, slots=True)
 class ManagedFile:
     app_id: int
     location: FileLocation
@@ -131,9 +187,15 @@ class ManagedFile:
     source_hash: Optional[str] = None
     had_backup: bool = False
     source_path: Optional[str] = None
+    # the target's state once it was known to hold source_hash; while it still
+    # matches, the target is trusted without being read again
+    target_state: Optional[TargetState] = field(default=None, compare=False)
 
+    def __post_init__(self):
+        _intern_fields(self, "location", "op")
 
-@dataclass
+
+@dataclass(frozen=True, slots=True)
 class FileOp:
     app_id: int
     location: FileLocation
@@ -142,20 +204,29 @@ class FileOp:
     overwrite_changes: bool
     executable: Optional[bool] = None
 
+    def __post_init__(self):
+        _intern_fields(self, "location")
 
-@dataclass
+
+@dataclass(frozen=True, slots=True)
 class RemoveOp:
     app_id: int
     location: FileLocation
     target: str
 
+    def __post_init__(self):
+        _intern_fields(self, "location")
 
-@dataclass
+
+@dataclass(frozen=True, slots=True)
 class ManagedDir:
     app_id: int
     location: FileLocation
     target: str
 
+    def __post_init__(self):
+        _intern_fields(self, "location")
+
 
 @dataclass
 class FilesManifest:
@@ -1,36 +1,86 @@
+import logging
+import mmap
+import os
 import struct
-from typing import Optional
+from array import array
+from pathlib import Path
+from typing import Iterator, Optional, Union
 
+from steam_config_patcher.fileio import atomic_write_bytes
 from steam_config_patcher.vdf import binary
 
+LOG = logging.getLogger(__name__)
+
 MAGIC_V40 = 0x07564428
 MAGIC_V41 = 0x07564429
 
+ICON_KEYS = ("icon", "clienticon")
+
+INDEX_NAME = "steam-config-nix-appinfo-index.bin"
+INDEX_MAGIC = b"SCNI"
+INDEX_VERSION = 1
+
 _HEADER = struct.Struct("<II")
 _STRING_TABLE_OFFSET = struct.Struct("<q")
 _UINT32 = struct.Struct("<I")
 
+# magic, version, appinfo.vdf size, appinfo.vdf mtime_ns
+_INDEX_HEADER = struct.Struct("<4sIQQ")
+# app id, record offset, record size
+_INDEX_ENTRY = struct.Struct("<IQI")
+
 _APP_HEADER_AFTER_SIZE = 4 + 4 + 8 + 20 + 4 + 20
 
+Buffer = Union[bytes, mmap.mmap]
+AppIndex = dict[int, tuple[int, int]]
+
 
 class AppInfoError(ValueError):
     pass
 
 
-def _read_string_table(data: bytes, offset: int) -> list[str]:
-    (count,) = _UINT32.unpack_from(data, offset)
-    position = offset + _UINT32.size
-    strings = []
-    for _ in range(count):
-        end = data.find(b"\x00", position)
-        if end == -1:
-            raise AppInfoError("unterminated string in string table")
-        strings.append(data[position:end].decode("utf-8"))
-        position = end + 1
-    return strings
+class _StringTable:
+    # v41 keys are indices into this table; entries are located and decoded
+    # only when a parsed record refers to them, then memoized
+    __slots__ = ("data", "count", "offsets", "scan_position", "strings")
+
+    def __init__(self, data: Buffer, offset: int):
+        (self.count,) = _UINT32.unpack_from(data, offset)
+        self.data = data
+        self.offsets = array("Q")
+        self.scan_position = offset + _UINT32.size
+        self.strings: dict[int, str] = {}
 
+    def __len__(self) -> int:
+        return self.count
 
-def _string_table_key_reader(strings: list[str]) -> binary.KeyReader:
+    def __getitem__(self, index: int) -> str:
+        value = self.strings.get(index)
+        if value is not None:
+            return value
+        if not 0 <= index < self.count:
+            raise IndexError(index)
+
+        data = self.data
+        offsets = self.offsets
+        while len(offsets) <= index:
+            end = data.find(b"\x00", self.scan_position)
+            if end == -1:
+                raise AppInfoError("unterminated string in string table")
+            offsets.append(self.scan_position)
+            self.scan_position = end + 1
+
+        start = offsets[index]
+        end = (
+            offsets[index + 1] - 1
+            if index + 1 < len(offsets)
+            else data.find(b"\x00", start)
+        )
+        value = self.strings[index] = data[start:end].decode("utf-8")
+        return value
+
+
+def _string_table_key_reader(strings: _StringTable) -> binary.KeyReader:
     def read_key(data: bytes, offset: int) -> tuple[str, int]:
         (index,) = _UINT32.unpack_from(data, offset)
         try:
@@ -41,36 +91,148 @@ def _string_table_key_reader(strings: list[str]) -> binary.KeyReader:
     return read_key
 
 
-def load_common(data: bytes, app_ids: Optional[set[int]] = None) -> dict[int, dict]:
+def _skip_string_table_key(data: bytes, offset: int) -> int:
+    return offset + _UINT32.size
+
+
+def _read_header(
+    data: Buffer,
+) -> tuple[int, binary.KeyReader, binary.KeySkipper]:
     (magic, _universe) = _HEADER.unpack_from(data, 0)
     if magic not in (MAGIC_V40, MAGIC_V41):
         raise AppInfoError(f"unsupported appinfo.vdf version 0x{magic:08x}")
 
     offset = _HEADER.size
     read_key = binary._read_cstring
+    skip_key = binary._skip_cstring
     if magic == MAGIC_V41:
         (string_table_offset,) = _STRING_TABLE_OFFSET.unpack_from(data, offset)
         offset += _STRING_TABLE_OFFSET.size
-        read_key = _string_table_key_reader(
-            _read_string_table(data, string_table_offset)
-        )
+        read_key = _string_table_key_reader(_StringTable(data, string_table_offset))
+        skip_key = _skip_string_table_key
 
-    result: dict[int, dict] = {}
+    return offset, read_key, skip_key
+
+
+def _iter_records(data: Buffer, offset: int) -> Iterator[tuple[int, int, int]]:
+    # yields (app_id, record offset, record size) without touching the blobs
     while offset < len(data):
         (app_id,) = _UINT32.unpack_from(data, offset)
         if app_id == 0:
             break
         (size,) = _UINT32.unpack_from(data, offset + _UINT32.size)
-        next_offset = offset + 2 * _UINT32.size + size
+        yield app_id, offset, size
+        offset += 2 * _UINT32.size + size
+
+
+def _common_projection(keys: Optional[tuple[str, ...]]) -> binary.Projection:
+    # the common block sits under the blob's single top-level dict
+    return {None: {"common": None if keys is None else dict.fromkeys(keys)}}
+
+
+def _read_common(
+    data: Buffer,
+    record_offset: int,
+    read_key: binary.KeyReader,
+    skip_key: binary.KeySkipper,
+    projection: binary.Projection,
+) -> Optional[dict]:
+    blob_offset = record_offset + 2 * _UINT32.size + _APP_HEADER_AFTER_SIZE
+    block, _ = binary.read_block(
+        data, blob_offset, read_key=read_key, projection=projection, skip_key=skip_key
+    )
+    return _find_common(block)
 
+
+def load_common(
+    data: bytes,
+    app_ids: Optional[set[int]] = None,
+    keys: Optional[tuple[str, ...]] = None,
+) -> dict[int, dict]:
+    offset, read_key, skip_key = _read_header(data)
+    projection = _common_projection(keys)
+
+    result: dict[int, dict] = {}
+    for app_id, record_offset, _size in _iter_records(data, offset):
         if app_ids is None or app_id in app_ids:
-            blob_offset = offset + 2 * _UINT32.size + _APP_HEADER_AFTER_SIZE
-            block, _ = binary.read_block(data, blob_offset, read_key=read_key)
-            common = _find_common(block)
+            common = _read_common(data, record_offset, read_key, skip_key, projection)
             if common is not None:
                 result[app_id] = common
 
-        offset = next_offset
+    return result
+
+
+def index_path(appinfo_path: Path) -> Path:
+    return appinfo_path.with_name(INDEX_NAME)
+
+
+def _load_index(path: Path, stat: os.stat_result) -> Optional[AppIndex]:
+    try:
+        raw = index_path(path).read_bytes()
+        magic, version, size, mtime_ns = _INDEX_HEADER.unpack_from(raw, 0)
+    except (OSError, struct.error):
+        return None
+    if (magic, version, size, mtime_ns) != (
+        INDEX_MAGIC,
+        INDEX_VERSION,
+        stat.st_size,
+        stat.st_mtime_ns,
+    ):
+        return None
+    body = memoryview(raw)[_INDEX_HEADER.size :]
+    if len(body) % _INDEX_ENTRY.size:
+        return None
+    return {
+        app_id: (offset, record_size)
+        for app_id, offset, record_size in _INDEX_ENTRY.iter_unpack(body)
+    }
+
+
+def _save_index(path: Path, stat: os.stat_result, index: AppIndex) -> None:
+    header = _INDEX_HEADER.pack(
+        INDEX_MAGIC, INDEX_VERSION, stat.st_size, stat.st_mtime_ns
+    )
+    entries = b"".join(
+        _INDEX_ENTRY.pack(app_id, offset, size)
+        for app_id, (offset, size) in index.items()
+    )
+    try:
+        atomic_write_bytes(index_path(path), header + entries)
+    except OSError:
+        LOG.debug("could not cache appinfo.vdf index", exc_info=True)
+
+
+def load_common_file(
+    path: Path, app_ids: set[int], keys: Optional[tuple[str, ...]] = None
+) -> dict[int, dict]:
+    # reads only the records for app_ids, through an index of record offsets
+    # cached next to appinfo.vdf and rebuilt when the file changes
+    with path.open("rb") as handle:
+        stat = os.fstat(handle.fileno())
+        if stat.st_size == 0:
+            raise AppInfoError("appinfo.vdf is empty")
+        with mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            offset, read_key, skip_key = _read_header(data)
+            projection = _common_projection(keys)
+
+            index = _load_index(path, stat)
+            if index is None:
+                index = {
+                    app_id: (record_offset, size)
+                    for app_id, record_offset, size in _iter_records(data, offset)
+                }
+                _save_index(path, stat, index)
+
+            result: dict[int, dict] = {}
+            for app_id in sorted(app_ids):
+                entry = index.get(app_id)
+                if entry is None:
+                    continue
+                common = _read_common(
+                    data, entry[0], read_key, skip_key, projection
+                )
+                if common is not None:
+                    result[app_id] = common
 
     return result
 
@@ -85,7 +247,7 @@ def _find_common(block: dict) -> Optional[dict]:
 
 
 def icon_hash(common: dict) -> Optional[str]:
-    for key in ("icon", "clienticon"):
+    for key in ICON_KEYS:
         value = common.get(key)
         if isinstance(value, str) and value:
             return value
@@ -1,5 +1,5 @@
 import struct
-from typing import Callable, Union
+from typing import BinaryIO, Callable, Iterable, Optional, Union
 
 _TYPE_DICT = 0x00
 _TYPE_STRING = 0x01
@@ -30,6 +30,20 @@ class BinaryVdfError(ValueError):
     pass
 
 
+# byte range of each nested dict's whole entry (type, key, body and end
+# marker) in the data it was read from, by key path
+Spans = dict[tuple[str, ...], tuple[int, int]]
+
+
+class BinaryDocument(dict):
+    # top-level dict returned by loads(..., lossless=True); keeps the source
+    # bytes so dumps can copy unchanged dicts verbatim
+    def __init__(self, source: bytes, spans: Spans):
+        super().__init__()
+        self.source = source
+        self.spans = spans
+
+
 def _read_cstring(data: bytes, offset: int) -> tuple[str, int]:
     end = data.find(b"\x00", offset)
     if end == -1:
@@ -37,113 +51,324 @@ def _read_cstring(data: bytes, offset: int) -> tuple[str, int]:
     return data[offset:end].decode("utf-8"), end + 1
 
 
+def _read_int32(data: bytes, offset: int) -> tuple[int, int]:
+    return _UINT32.unpack_from(data, offset)[0], offset + _UINT32.size
+
+
+def _read_uint64(data: bytes, offset: int) -> tuple[Uint64, int]:
+    return Uint64(_UINT64.unpack_from(data, offset)[0]), offset + _UINT64.size
+
+
+def _read_int64(data: bytes, offset: int) -> tuple[Int64, int]:
+    return Int64(_INT64.unpack_from(data, offset)[0]), offset + _INT64.size
+
+
+def _read_float32(data: bytes, offset: int) -> tuple[float, int]:
+    return _FLOAT32.unpack_from(data, offset)[0], offset + _FLOAT32.size
+
+
+_VALUE_READERS: dict[int, Callable[[bytes, int], tuple[BinaryVdfValue, int]]] = {
+    _TYPE_STRING: _read_cstring,
+    _TYPE_INT32: _read_int32,
+    _TYPE_UINT64: _read_uint64,
+    _TYPE_INT64: _read_int64,
+    _TYPE_FLOAT32: _read_float32,
+}
+
+_FIXED_SIZES = {
+    _TYPE_INT32: _UINT32.size,
+    _TYPE_UINT64: _UINT64.size,
+    _TYPE_INT64: _INT64.size,
+    _TYPE_FLOAT32: _FLOAT32.size,
+}
+
 KeyReader = Callable[[bytes, int], tuple[str, int]]
+KeySkipper = Callable[[bytes, int], int]
+
+# keys to keep when reading a block: a nested projection for dicts to be read
+# partially, or None to keep the whole value; a None key matches any key
+Projection = dict[Optional[str], Optional["Projection"]]
+
+
+def _skip_cstring(data: bytes, offset: int) -> int:
+    end = data.find(b"\x00", offset)
+    if end == -1:
+        raise BinaryVdfError("unterminated string")
+    return end + 1
+
+
+def _skip_value(data: bytes, offset: int, value_type: int, skip_key: KeySkipper) -> int:
+    # binary KeyValues carry no subtree lengths, so a skipped dict is still
+    # scanned entry by entry, but nothing in it is decoded or stored
+    depth = 0
+    length = len(data)
+    while True:
+        if value_type == _TYPE_DICT:
+            depth += 1
+        elif value_type == _TYPE_STRING:
+            offset = _skip_cstring(data, offset)
+        elif value_type == _TYPE_END or value_type == _TYPE_END_ALT:
+            depth -= 1
+        else:
+            size = _FIXED_SIZES.get(value_type)
+            if size is None:
+                raise BinaryVdfError(f"unsupported value type 0x{value_type:02x}")
+            offset += size
+
+        if depth == 0:
+            return offset
+        if offset >= length:
+            raise BinaryVdfError("unexpected end of data")
+        value_type = data[offset]
+        offset += 1
+        if value_type != _TYPE_END and value_type != _TYPE_END_ALT:
+            offset = skip_key(data, offset)
 
 
 def _read_dict(
-    data: bytes, offset: int, top_level: bool, read_key: KeyReader
+    data: bytes,
+    offset: int,
+    top_level: bool,
+    read_key: KeyReader,
+    result: Optional[dict] = None,
+    spans: Optional[Spans] = None,
 ) -> tuple[dict, int]:
-    result: dict[str, BinaryVdfValue] = {}
+    if result is None:
+        result = {}
+    # dicts enclosing the one being filled, so nesting depth isn't bounded by
+    # the recursion limit
+    parents: list[dict[str, BinaryVdfValue]] = []
+    # key path and entry start of each open dict, only tracked for spans
+    open_entries: list[tuple[tuple[str, ...], int]] = []
+    current = result
+    readers = _VALUE_READERS
+    length = len(data)
     while True:
-        if offset >= len(data):
-            if top_level:
+        if offset >= length:
+            if top_level and not parents:
                 return result, offset
             raise BinaryVdfError("unexpected end of data")
 
+        entry_start = offset
         value_type = data[offset]
         offset += 1
-        if value_type in (_TYPE_END, _TYPE_END_ALT):
-            return result, offset
+        if value_type == _TYPE_END or value_type == _TYPE_END_ALT:
+            if not parents:
+                return result, offset
+            current = parents.pop()
+            if spans is not None:
+                path, start = open_entries.pop()
+                spans[path] = (start, offset)
+            continue
 
         key, offset = read_key(data, offset)
 
         if value_type == _TYPE_DICT:
-            value, offset = _read_dict(data, offset, top_level=False, read_key=read_key)
-        elif value_type == _TYPE_STRING:
-            value, offset = _read_cstring(data, offset)
-        elif value_type == _TYPE_INT32:
-            (value,) = _UINT32.unpack_from(data, offset)
-            offset += _UINT32.size
-        elif value_type == _TYPE_UINT64:
-            (raw,) = _UINT64.unpack_from(data, offset)
-            value = Uint64(raw)
-            offset += _UINT64.size
-        elif value_type == _TYPE_INT64:
-            (raw,) = _INT64.unpack_from(data, offset)
-            value = Int64(raw)
-            offset += _INT64.size
-        elif value_type == _TYPE_FLOAT32:
-            (value,) = _FLOAT32.unpack_from(data, offset)
-            offset += _FLOAT32.size
-        else:
-            raise BinaryVdfError(f"unsupported value type 0x{value_type:02x}")
-
-        result[key] = value
+            child: dict[str, BinaryVdfValue] = {}
+            current[key] = child
+            parents.append(current)
+            current = child
+            if spans is not None:
+                parent_path = open_entries[-1][0] if open_entries else ()
+                open_entries.append((parent_path + (key,), entry_start))
+            continue
 
-    return result, offset
+        reader = readers.get(value_type)
+        if reader is None:
+            raise BinaryVdfError(f"unsupported value type 0x{value_type:02x}")
+        current[key], offset = reader(data, offset)
 
 
-def loads(data: bytes) -> dict:
-    result, offset = _read_dict(data, 0, top_level=True, read_key=_read_cstring)
+def loads(data: bytes, lossless: bool = False) -> dict:
+    if lossless:
+        document = BinaryDocument(data, {})
+        result, offset = _read_dict(
+            data,
+            0,
+            top_level=True,
+            read_key=_read_cstring,
+            result=document,
+            spans=document.spans,
+        )
+    else:
+        result, offset = _read_dict(data, 0, top_level=True, read_key=_read_cstring)
     if offset != len(data):
         raise BinaryVdfError("trailing data after top-level block")
     return result
 
 
+def _read_projected_dict(
+    data: bytes,
+    offset: int,
+    read_key: KeyReader,
+    skip_key: KeySkipper,
+    projection: Projection,
+) -> tuple[dict, int]:
+    result: dict[str, BinaryVdfValue] = {}
+    parents: list[tuple[dict[str, BinaryVdfValue], Optional[Projection]]] = []
+    current = result
+    current_projection: Optional[Projection] = projection
+    readers = _VALUE_READERS
+    length = len(data)
+    while True:
+        if offset >= length:
+            raise BinaryVdfError("unexpected end of data")
+
+        value_type = data[offset]
+        offset += 1
+        if value_type == _TYPE_END or value_type == _TYPE_END_ALT:
+            if not parents:
+                return result, offset
+            current, current_projection = parents.pop()
+            continue
+
+        key, offset = read_key(data, offset)
+
+        child_projection = None
+        if current_projection is not None:
+            if key in current_projection:
+                child_projection = current_projection[key]
+            elif None in current_projection:
+                child_projection = current_projection[None]
+            else:
+                offset = _skip_value(data, offset, value_type, skip_key)
+                continue
+
+        if value_type == _TYPE_DICT:
+            child: dict[str, BinaryVdfValue] = {}
+            current[key] = child
+            parents.append((current, current_projection))
+            current = child
+            current_projection = child_projection
+            continue
+
+        reader = readers.get(value_type)
+        if reader is None:
+            raise BinaryVdfError(f"unsupported value type 0x{value_type:02x}")
+        current[key], offset = reader(data, offset)
+
+
 def read_block(
-    data: bytes, offset: int, read_key: KeyReader = _read_cstring
+    data: bytes,
+    offset: int,
+    read_key: KeyReader = _read_cstring,
+    projection: Optional[Projection] = None,
+    skip_key: KeySkipper = _skip_cstring,
 ) -> tuple[dict, int]:
+    if projection is not None:
+        return _read_projected_dict(data, offset, read_key, skip_key, projection)
     return _read_dict(data, offset, top_level=False, read_key=read_key)
 
 
-def _write_cstring(value: str, parts: list[bytes]) -> None:
+def _encode_cstring(value: str) -> bytes:
     encoded = value.encode("utf-8")
     if b"\x00" in encoded:
         raise BinaryVdfError("strings cannot contain null bytes")
-    parts.append(encoded)
-    parts.append(b"\x00")
+    return encoded + b"\x00"
+
+
+# zero padding for each packed value size, shared between values
+_ZEROS = {
+    packer.size: bytes(packer.size) for packer in (_UINT32, _UINT64, _INT64, _FLOAT32)
+}
+
+
+class _Reuse:
+    # what dumps may copy from a lossless document instead of encoding:
+    # dicts that were read from it and that nothing changed at or below
+    __slots__ = ("source", "spans", "changed", "dirty")
+
+    def __init__(self, document: BinaryDocument, changed: Iterable[tuple[str, ...]]):
+        self.source = memoryview(document.source)
+        self.spans = document.spans
+        self.changed = set(changed)
+        self.dirty = {
+            path[:depth] for path in self.changed for depth in range(len(path))
+        }
 
 
-def _write_dict(obj: dict, parts: list[bytes]) -> None:
+def _header(headers: dict[tuple[int, str], bytes], value_type: int, key: str) -> bytes:
+    # every entry starts with its type byte and key; shortcuts repeat the same
+    # few keys hundreds of times, so each prefix is encoded once per dump
+    header = headers.get((value_type, key))
+    if header is None:
+        header = bytes((value_type,)) + _encode_cstring(key)
+        headers[(value_type, key)] = header
+    return header
+
+
+def _write_dict(
+    obj: dict,
+    out: bytearray,
+    headers: dict[tuple[int, str], bytes],
+    reuse: Optional[_Reuse] = None,
+    path: tuple[str, ...] = (),
+) -> None:
     for key, value in obj.items():
         if isinstance(value, dict):
-            parts.append(bytes([_TYPE_DICT]))
-            _write_cstring(key, parts)
-            _write_dict(value, parts)
+            child_reuse = reuse
+            if reuse is not None:
+                child_path = path + (key,)
+                if child_path in reuse.changed:
+                    # replaced wholesale, nothing below came from the source
+                    child_reuse = None
+                elif child_path not in reuse.dirty and child_path in reuse.spans:
+                    start, end = reuse.spans[child_path]
+                    out += reuse.source[start:end]
+                    continue
+            out += _header(headers, _TYPE_DICT, key)
+            _write_dict(value, out, headers, child_reuse, path + (key,))
         elif isinstance(value, str):
-            parts.append(bytes([_TYPE_STRING]))
-            _write_cstring(key, parts)
-            _write_cstring(value, parts)
+            out += _header(headers, _TYPE_STRING, key)
+            out += _encode_cstring(value)
         elif isinstance(value, Uint64):
-            parts.append(bytes([_TYPE_UINT64]))
-            _write_cstring(key, parts)
-            parts.append(_UINT64.pack(value))
+            out += _header(headers, _TYPE_UINT64, key)
+            _pack_into(out, _UINT64, value)
         elif isinstance(value, Int64):
-            parts.append(bytes([_TYPE_INT64]))
-            _write_cstring(key, parts)
-            parts.append(_INT64.pack(value))
+            out += _header(headers, _TYPE_INT64, key)
+            _pack_into(out, _INT64, value)
         elif isinstance(value, bool):
             raise BinaryVdfError(f"unsupported value type for key {key!r}: bool")
         elif isinstance(value, int):
             if not 0 <= value <= 0xFFFFFFFF:
                 raise BinaryVdfError(f"int value out of uint32 range for key {key!r}")
-            parts.append(bytes([_TYPE_INT32]))
-            _write_cstring(key, parts)
-            parts.append(_UINT32.pack(value))
+            out += _header(headers, _TYPE_INT32, key)
+            _pack_into(out, _UINT32, value)
         elif isinstance(value, float):
-            parts.append(bytes([_TYPE_FLOAT32]))
-            _write_cstring(key, parts)
-            parts.append(_FLOAT32.pack(value))
+            out += _header(headers, _TYPE_FLOAT32, key)
+            _pack_into(out, _FLOAT32, value)
         else:
             raise BinaryVdfError(
                 f"unsupported value type for key {key!r}: {type(value).__name__}"
             )
-    parts.append(bytes([_TYPE_END]))
+    out.append(_TYPE_END)
+
+
+def _pack_into(out: bytearray, packer: struct.Struct, value: Union[int, float]) -> None:
+    # grow in place and pack over the zeros, no temporary bytes object
+    offset = len(out)
+    out += _ZEROS[packer.size]
+    packer.pack_into(out, offset, value)
 
 
-def dumps(obj: dict) -> bytes:
+def encode(obj: dict, changed: Optional[Iterable[tuple[str, ...]]] = None) -> bytearray:
+    # given the key paths changed since obj was loaded losslessly, dicts
+    # outside them are copied from the source bytes instead of re-encoded
+    out = bytearray()
     if not obj:
-        return b""
-    parts: list[bytes] = []
-    _write_dict(obj, parts)
-    return b"".join(parts)
+        return out
+    reuse = None
+    if changed is not None and isinstance(obj, BinaryDocument):
+        reuse = _Reuse(obj, changed)
+    _write_dict(obj, out, {}, reuse)
+    return out
+
+
+def dumps(obj: dict, changed: Optional[Iterable[tuple[str, ...]]] = None) -> bytes:
+    return bytes(encode(obj, changed))
+
+
+def dump(
+    obj: dict, fp: BinaryIO, changed: Optional[Iterable[tuple[str, ...]]] = None
+) -> None:
+    fp.write(encode(obj, changed))
@@ -1,7 +1,30 @@
-from typing import Iterator, Optional
+import functools
+import io
+import re
+from typing import BinaryIO, Callable, Iterator, Optional
 
 _ESCAPES = {"n": "\n", "t": "\t", "r": "\r", '"': '"', "\\": "\\"}
 _UNESCAPES = {"\\": "\\\\", '"': '\\"', "\n": "\\n", "\t": "\\t", "\r": "\\r"}
+_ESCAPE_TABLE = str.maketrans(_UNESCAPES)
+
+# each match skips leading whitespace and comments, then reads one token, so
+# consecutive matches cover the whole text; a backslash inside quotes is
+# consumed together with the next character, so an escaped quote never ends a
+# string (unknown escapes are kept by _unescape)
+_TOKEN_RE = re.compile(
+    r"""
+    (?:[ \t\r\n]+|//[^\n]*)*
+    (?:
+        (?P<open>\{)
+        |(?P<close>\})
+        |"(?P<quoted>[^"\\]*(?:\\.[^"\\]*)*)"
+        |(?P<bare>[^ \t\r\n{}"]+)
+        |(?P<unterminated>")
+    )?
+    """,
+    re.VERBOSE | re.DOTALL,
+)
+_ESCAPE_RE = re.compile(r"\\(.)", re.DOTALL)
 
 _TOKEN_STRING = "string"
 _TOKEN_OPEN = "open"
@@ -14,8 +37,72 @@ class VdfSyntaxError(ValueError):
         self.line = line
 
 
+def _mark_dirty(node: Optional["VdfNode"]) -> None:
+    # only nodes parsed with spans are tracked; their ancestors are marked too
+    # so the lossless writer can copy any clean subtree without visiting it
+    while node is not None and node._span is not None and not node._dirty:
+        node._dirty = True
+        node = node._parent
+
+
+def _invalidates(method):
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        self._index = None
+        _mark_dirty(self._owner)
+        return method(self, *args, **kwargs)
+
+    return wrapper
+
+
+class _Children(list):
+    # child list that keeps a casefolded name -> children index, built on the
+    # first lookup; appends extend it in place, any other mutation drops it
+    __slots__ = ("_index", "_owner")
+
+    def __init__(self, owner: "VdfNode", iterable=()):
+        super().__init__(iterable)
+        self._index: Optional[dict[str, list["VdfNode"]]] = None
+        self._owner = owner
+
+    def lookup(self, folded: str) -> list["VdfNode"]:
+        if self._index is None:
+            index: dict[str, list[VdfNode]] = {}
+            for child in self:
+                index.setdefault(child.name.casefold(), []).append(child)
+            self._index = index
+        return self._index.get(folded, [])
+
+    def append(self, node: "VdfNode") -> None:
+        super().append(node)
+        if self._index is not None:
+            self._index.setdefault(node.name.casefold(), []).append(node)
+        _mark_dirty(self._owner)
+
+    __setitem__ = _invalidates(list.__setitem__)
+    __delitem__ = _invalidates(list.__delitem__)
+    __iadd__ = _invalidates(list.__iadd__)
+    __imul__ = _invalidates(list.__imul__)
+    extend = _invalidates(list.extend)
+    insert = _invalidates(list.insert)
+    remove = _invalidates(list.remove)
+    pop = _invalidates(list.pop)
+    clear = _invalidates(list.clear)
+    sort = _invalidates(list.sort)
+    reverse = _invalidates(list.reverse)
+
+
+# offsets into the source text recorded by loads(..., lossless=True):
+#   leaf:  (lead, start, value_start, end)
+#   block: (lead, start, open_end, close_lead, close_start, end)
+# lead is where the previous sibling (or the opening brace) ended, so
+# source[lead:start] is the whitespace and comments in front of the node, and
+# source[close_lead:close_start] is what sits before the closing brace
+Span = tuple[int, ...]
+
+
 class VdfNode:
-    __slots__ = ("name", "value", "children")
+    __slots__ = ("name", "_value", "_children", "_span", "_parent", "_dirty")
 
     def __init__(
         self,
@@ -23,10 +110,34 @@ class VdfNode:
         value: Optional[str] = None,
         children: Optional[list["VdfNode"]] = None,
     ):
+        self._span: Optional[Span] = None
+        self._parent: Optional[VdfNode] = None
+        self._dirty = False
         self.name = name
-        self.value = value
+        self._value = value
         self.children = children
 
+    @property
+    def value(self) -> Optional[str]:
+        return self._value
+
+    @value.setter
+    def value(self, value: Optional[str]) -> None:
+        self._value = value
+        _mark_dirty(self)
+
+    # child names are not expected to change once a node is in a block, so
+    # renaming a child in place is not tracked by the parent's lookup index
+    # or by the lossless writer
+    @property
+    def children(self) -> Optional[list["VdfNode"]]:
+        return self._children
+
+    @children.setter
+    def children(self, children: Optional[list["VdfNode"]]) -> None:
+        self._children = None if children is None else _Children(self, children)
+        _mark_dirty(self)
+
     @property
     def is_block(self) -> bool:
         return self.children is not None
@@ -46,11 +157,10 @@ class VdfNode:
         return f"VdfNode({self.name!r}, value={self.value!r})"
 
     def find_all(self, *key_path: str) -> Iterator["VdfNode"]:
+        if self._children is None:
+            return
         name, *rest = key_path
-        folded = name.casefold()
-        for child in self.children or []:
-            if child.name.casefold() != folded:
-                continue
+        for child in self._children.lookup(name.casefold()):
             if not rest:
                 yield child
             elif child.is_block:
@@ -63,7 +173,8 @@ class VdfNode:
         folded = name.casefold()
         remaining = [c for c in self.children if c.name.casefold() != folded]
         removed = len(remaining) != len(self.children)
-        self.children[:] = remaining
+        if removed:
+            self.children[:] = remaining
         return removed
 
     def set_path(self, key_path: tuple[str, ...], value: str) -> None:
@@ -86,110 +197,227 @@ class VdfNode:
             leaf.value = value
 
 
-def _read_quoted(text: str, start: int, line: int) -> tuple[str, int, int]:
-    parts = []
-    i = start + 1
-    while i < len(text):
-        c = text[i]
-        if c == '"':
-            return "".join(parts), i + 1, line
-        if c == "\\" and i + 1 < len(text):
-            escaped = text[i + 1]
-            if escaped in _ESCAPES:
-                parts.append(_ESCAPES[escaped])
-                i += 2
-                continue
-        if c == "\n":
-            line += 1
-        parts.append(c)
-        i += 1
-    raise VdfSyntaxError("unterminated string", line)
-
-
-def _tokenize(text: str) -> Iterator[tuple[str, Optional[str], int]]:
-    i = 0
-    line = 1
-    length = len(text)
-    while i < length:
-        c = text[i]
-        if c == "\n":
-            line += 1
-            i += 1
-        elif c in " \t\r":
-            i += 1
-        elif c == "/" and text[i + 1 : i + 2] == "/":
-            newline = text.find("\n", i)
-            i = length if newline == -1 else newline
-        elif c == "{":
-            yield _TOKEN_OPEN, None, line
-            i += 1
-        elif c == "}":
-            yield _TOKEN_CLOSE, None, line
-            i += 1
-        elif c == '"':
-            start_line = line
-            value, i, line = _read_quoted(text, i, line)
-            yield _TOKEN_STRING, value, start_line
-        else:
-            start = i
-            while i < length and text[i] not in ' \t\r\n{}"':
-                i += 1
-            yield _TOKEN_STRING, text[start:i], line
+class VdfDocument(VdfNode):
+    # root returned by loads(..., lossless=True); keeps the source text so the
+    # writers can copy untouched regions verbatim
+    __slots__ = ("source",)
+
+    def __init__(self, source: str):
+        super().__init__(children=[])
+        self.source = source
+
+
+def _unescape_match(match: re.Match) -> str:
+    return _ESCAPES.get(match.group(1), match.group(0))
+
+
+def _unescape(raw: str) -> str:
+    if "\\" not in raw:
+        return raw
+    return _ESCAPE_RE.sub(_unescape_match, raw)
+
 
+def _line_at(text: str, offset: int) -> int:
+    return text.count("\n", 0, offset) + 1
 
-def loads(text: str) -> VdfNode:
-    root = VdfNode(children=[])
+
+# tokens carry their source offsets; line numbers are only worked out when a
+# syntax error needs one
+def _tokenize(text: str) -> Iterator[tuple[str, Optional[str], int, int]]:
+    for m in _TOKEN_RE.finditer(text):
+        kind = m.lastgroup
+        if kind == "quoted":
+            yield _TOKEN_STRING, _unescape(m.group(kind)), m.start(kind) - 1, m.end()
+        elif kind == "bare":
+            yield _TOKEN_STRING, m.group(kind), m.start(kind), m.end()
+        elif kind == "open":
+            yield _TOKEN_OPEN, None, m.start(kind), m.end()
+        elif kind == "close":
+            yield _TOKEN_CLOSE, None, m.start(kind), m.end()
+        elif kind == "unterminated":
+            raise VdfSyntaxError("unterminated string", _line_at(text, len(text)))
+
+
+def loads(text: str, lossless: bool = False) -> VdfNode:
+    root = VdfDocument(text) if lossless else VdfNode(children=[])
     stack = [root]
     pending_key: Optional[str] = None
-    line = 1
+    key_start = 0
+    offset = 0
+    # for each open block, the lead and start of its key, where its opening
+    # brace ended and where its latest child ended; only used when lossless
+    frames = [[0, 0, 0, 0]]
 
-    for token_type, token_value, token_line in _tokenize(text):
-        line = token_line
+    for token_type, token_value, offset, end in _tokenize(text):
         if pending_key is None:
             if token_type == _TOKEN_STRING:
                 pending_key = token_value
+                key_start = offset
             elif token_type == _TOKEN_CLOSE:
                 if len(stack) == 1:
-                    raise VdfSyntaxError("unexpected '}'", token_line)
-                stack.pop()
+                    raise VdfSyntaxError("unexpected '}'", _line_at(text, offset))
+                block = stack.pop()
+                if lossless:
+                    lead, start, open_end, last_end = frames.pop()
+                    block._span = (lead, start, open_end, last_end, offset, end)
+                    frames[-1][3] = end
             else:
-                raise VdfSyntaxError("unexpected '{'", token_line)
+                raise VdfSyntaxError("unexpected '{'", _line_at(text, offset))
         else:
             if token_type == _TOKEN_STRING:
-                stack[-1].children.append(VdfNode(pending_key, value=token_value))
+                leaf = VdfNode(pending_key, value=token_value)
+                stack[-1].children.append(leaf)
+                if lossless:
+                    frame = frames[-1]
+                    leaf._span = (frame[3], key_start, offset, end)
+                    leaf._parent = stack[-1]
+                    frame[3] = end
             elif token_type == _TOKEN_OPEN:
                 block = VdfNode(pending_key, children=[])
                 stack[-1].children.append(block)
                 stack.append(block)
+                if lossless:
+                    block._parent = stack[-2]
+                    frames.append([frames[-1][3], key_start, end, end])
             else:
-                raise VdfSyntaxError(f"key {pending_key!r} has no value", token_line)
+                raise VdfSyntaxError(
+                    f"key {pending_key!r} has no value", _line_at(text, offset)
+                )
             pending_key = None
 
     if pending_key is not None:
-        raise VdfSyntaxError(f"key {pending_key!r} has no value", line)
+        raise VdfSyntaxError(
+            f"key {pending_key!r} has no value", _line_at(text, offset)
+        )
     if len(stack) > 1:
-        raise VdfSyntaxError(f"unclosed block {stack[-1].name!r}", line)
+        raise VdfSyntaxError(
+            f"unclosed block {stack[-1].name!r}", _line_at(text, offset)
+        )
+
+    if lossless:
+        root._span = (0, 0, 0, frames[0][3], len(text), len(text))
 
     return root
 
 
 def _escape(value: str) -> str:
-    return "".join(_UNESCAPES.get(c, c) for c in value)
+    return value.translate(_ESCAPE_TABLE)
 
 
-def _write_node(node: VdfNode, depth: int, parts: list[str]) -> None:
+def _write_node(node: VdfNode, depth: int, write: Callable[[str], object]) -> None:
     indent = "\t" * depth
     if node.is_block:
-        parts.append(f'{indent}"{_escape(node.name)}"\n{indent}{{\n')
+        write(f'{indent}"{_escape(node.name)}"\n{indent}{{\n')
         for child in node.children:
-            _write_node(child, depth + 1, parts)
-        parts.append(f"{indent}}}\n")
+            _write_node(child, depth + 1, write)
+        write(f"{indent}}}\n")
+    else:
+        write(f'{indent}"{_escape(node.name)}"\t\t"{_escape(node.value)}"\n')
+
+
+def _render(node: VdfNode, depth: int) -> str:
+    parts: list[str] = []
+    _write_node(node, depth, parts.append)
+    return "".join(parts)
+
+
+class _Splicer:
+    # writes source slices, merging adjacent ones into a single write
+    __slots__ = ("source", "write", "start", "end", "empty")
+
+    def __init__(self, source: str, write: Callable[[str], object]):
+        self.source = source
+        self.write = write
+        self.start = self.end = -1
+        self.empty = True
+
+    def copy(self, start: int, end: int) -> None:
+        if start != self.end:
+            self.flush()
+            self.start = start
+        self.end = end
+
+    @property
+    def at_start(self) -> bool:
+        return self.empty and self.end <= self.start
+
+    def text(self, value: str) -> None:
+        self.flush()
+        self.write(value)
+        self.empty = False
+
+    def flush(self) -> None:
+        if self.end > self.start:
+            self.write(self.source[self.start : self.end])
+            self.empty = False
+        self.start = self.end = -1
+
+
+def _splice_children(block: VdfNode, depth: int, out: _Splicer) -> None:
+    for child in block.children:
+        span = child._span
+        if span is None:
+            # added after parsing, laid out the way Steam writes it
+            separator = "" if out.at_start else "\n"
+            out.text(separator + _render(child, depth)[:-1])
+            continue
+
+        lead = span[0]
+        if out.at_start and lead != 0:
+            # its leading whitespace separated it from a node that is gone
+            lead = span[1]
+        elif lead == span[1] and out.end != lead and not out.at_start:
+            # it was glued to whatever preceded it in the source; keep it
+            # apart from its new neighbour
+            out.text("\n" + "\t" * depth)
+
+        if not child._dirty:
+            out.copy(lead, span[-1])
+        elif child.is_block != (len(span) == 6):
+            out.copy(lead, span[1])
+            out.text(_render(child, depth)[:-1])
+        elif child.is_block:
+            out.copy(lead, span[2])
+            _splice_children(child, depth + 1, out)
+            out.copy(span[3], span[5])
+        else:
+            out.copy(lead, span[2])
+            out.text(f'"{_escape(child.value)}"')
+
+
+def _write_document(root: VdfNode, write: Callable[[str], object]) -> bool:
+    if not isinstance(root, VdfDocument) or root._span is None:
+        return False
+    # nothing was parsed to splice into, the plain writer lays it out as well
+    if root._dirty and root._span[3] == 0:
+        return False
+    out = _Splicer(root.source, write)
+    if root._dirty:
+        _splice_children(root, 0, out)
+        if not out.at_start:
+            out.copy(root._span[3], root._span[5])
     else:
-        parts.append(f'{indent}"{_escape(node.name)}"\t\t"{_escape(node.value)}"\n')
+        out.copy(0, len(root.source))
+    out.flush()
+    return True
 
 
 def dumps(root: VdfNode) -> str:
     parts: list[str] = []
-    for child in root.children:
-        _write_node(child, 0, parts)
+    if not _write_document(root, parts.append):
+        for child in root.children:
+            _write_node(child, 0, parts.append)
     return "".join(parts)
+
+
+def dump(root: VdfNode, fp: BinaryIO) -> None:
+    # the wrapper batches the small per-node strings and encodes them in bulk
+    # as its buffer fills, so the serialized file is never held in memory
+    writer = io.TextIOWrapper(fp, encoding="utf-8", newline="")
+    try:
+        if not _write_document(root, writer.write):
+            for child in root.children:
+                _write_node(child, 0, writer.write)
+        writer.flush()
+    finally:
+        writer.detach()
@@ -1,3 +1,6 @@
+import pytest
+
+from steam_config_patcher.fileio import atomic_write, file_state
 from steam_config_patcher.formats.binary_keyvalues import (
     delete_key,
     prepare_binary_keyvalues,
@@ -40,10 +43,10 @@ def make_patch(file_path, data, deletions=()):
 
 
 def apply(patch):
-    data = prepare_binary_keyvalues(patch)
-    if data is None:
+    write = prepare_binary_keyvalues(patch)
+    if write is None:
         return False
-    patch.file_path.write_bytes(data)
+    atomic_write(patch.file_path, write)
     return True
 
 
@@ -63,6 +66,20 @@ def test_recursive_update_changes_leaf():
     assert destination == {"shortcuts": {"0": {"appid": 1, "AppName": "New"}}}
 
 
+def test_recursive_update_reports_changed_paths_and_copies_dicts():
+    destination = {"shortcuts": {"0": {"appid": 1, "AppName": "Old"}}}
+    source = {"shortcuts": {"0": {"AppName": "New"}, "1": {"tags": {}}}}
+    changed = set()
+
+    assert recursive_update(destination, source, changed)
+
+    assert changed == {("shortcuts", "0", "AppName"), ("shortcuts", "1")}
+    assert destination["shortcuts"]["1"] == source["shortcuts"]["1"]
+    assert destination["shortcuts"]["1"] is not source["shortcuts"]["1"]
+    tags = destination["shortcuts"]["1"]["tags"]
+    assert tags is not source["shortcuts"]["1"]["tags"]
+
+
 def test_recursive_update_identical_reports_unmodified():
     destination = {"shortcuts": {"0": {"appid": 1}}}
 
@@ -132,6 +149,48 @@ def test_prepare_does_not_write(tmp_path):
     assert path.read_bytes() == original_bytes
 
 
+def test_reuses_tree_parsed_while_generating(tmp_path, monkeypatch):
+    path = tmp_path / "shortcuts.vdf"
+    write_shortcuts(path, {"shortcuts": {"0": shortcut(111, "Game")}})
+    patch = make_patch(path, {"shortcuts": {"1": shortcut(222, "Other")}})
+    patch.parsed = read_shortcuts(path)
+    patch.parsed_state = file_state(path)
+    monkeypatch.setattr(
+        "steam_config_patcher.formats.binary_keyvalues.loads",
+        lambda data: pytest.fail("parsed shortcuts.vdf twice"),
+    )
+
+    assert apply(patch)
+
+    assert sorted(read_shortcuts(path)["shortcuts"]) == ["0", "1"]
+
+
+def test_reparses_when_file_changed_since_generating(tmp_path):
+    path = tmp_path / "shortcuts.vdf"
+    write_shortcuts(path, {"shortcuts": {"0": shortcut(111, "Game")}})
+    patch = make_patch(path, {"shortcuts": {"1": shortcut(222, "Other")}})
+    patch.parsed = read_shortcuts(path)
+    patch.parsed_state = file_state(path)
+    write_shortcuts(path, {"shortcuts": {"5": shortcut(555, "Added by Steam")}})
+
+    assert apply(patch)
+
+    assert sorted(read_shortcuts(path)["shortcuts"]) == ["1", "5"]
+
+
+def test_untouched_shortcuts_keep_their_bytes(tmp_path):
+    path = tmp_path / "shortcuts.vdf"
+    # steam's own alt end marker survives because the entry is copied, not re-encoded
+    untouched = binary.dumps({"0": shortcut(111, "Game")})[:-2] + b"\x0b\x08"
+    path.write_bytes(b"\x00shortcuts\x00" + untouched + b"\x08")
+    patch = make_patch(path, {"shortcuts": {"1": shortcut(222, "Other")}})
+
+    assert apply(patch)
+
+    assert untouched[:-1] in path.read_bytes()
+    assert sorted(read_shortcuts(path)["shortcuts"]) == ["0", "1"]
+
+
 def test_missing_file_is_created(tmp_path):
     path = tmp_path / "shortcuts.vdf"
     patch = make_patch(path, {"shortcuts": {"0": shortcut(111, "Game")}})
@@ -175,6 +234,25 @@ def test_deletion_removes_shortcut(tmp_path):
     assert result["shortcuts"]["0"]["AppName"] == "Keep"
 
 
+def test_replaced_dict_takes_patch_key_order(tmp_path):
+    path = tmp_path / "shortcuts.vdf"
+    write_shortcuts(
+        path,
+        {"shortcuts": {"1": shortcut(111, "A"), "0": shortcut(222, "B")}, "after": 1},
+    )
+    patch = make_patch(
+        path, {"shortcuts": {"0": shortcut(111, "A"), "1": shortcut(222, "B")}}
+    )
+    patch.replaced = [("shortcuts",)]
+
+    assert apply(patch)
+
+    result = read_shortcuts(path)
+    assert list(result) == ["shortcuts", "after"]
+    assert list(result["shortcuts"]) == ["0", "1"]
+    assert result["shortcuts"]["0"]["AppName"] == "A"
+
+
 def test_generated_appid_range_roundtrip(tmp_path):
     appid = 0x914B9DA1
     path = tmp_path / "shortcuts.vdf"
@@ -1,8 +1,10 @@
+import hashlib
 import os
 from types import SimpleNamespace
 
 import pytest
 
+from steam_config_patcher import files
 from steam_config_patcher.files import FileOpConflict, apply_file_ops
 from steam_config_patcher.files_manifest import backup_path, load_files_manifest
 from steam_config_patcher.types import FileOp, RemoveOp
@@ -20,12 +22,12 @@ def env(tmp_path, monkeypatch):
     src.mkdir()
 
     monkeypatch.setattr(
-        "steam_config_patcher.files.find_app_install_dir",
-        lambda sd, aid: install if install.is_dir() else None,
+        "steam_config_patcher.steam.SteamLibraryIndex.install_dir",
+        lambda self, aid: install if install.is_dir() else None,
     )
     monkeypatch.setattr(
-        "steam_config_patcher.files.find_app_compat_prefix",
-        lambda sd, aid: prefix if prefix.is_dir() else None,
+        "steam_config_patcher.steam.SteamLibraryIndex.compat_prefix",
+        lambda self, aid: prefix if prefix.is_dir() else None,
     )
     return SimpleNamespace(
         steam_dir=steam_dir, install=install, prefix=prefix, src=src
@@ -252,7 +254,8 @@ def test_root_not_found_skips_and_keeps_prev(env, monkeypatch):
     apply_file_ops(env.steam_dir, [place(env, "foo.dll", src)], [])
 
     monkeypatch.setattr(
-        "steam_config_patcher.files.find_app_install_dir", lambda sd, aid: None
+        "steam_config_patcher.steam.SteamLibraryIndex.install_dir",
+        lambda self, aid: None,
     )
     apply_file_ops(env.steam_dir, [place(env, "foo.dll", src)], [])
 
@@ -351,6 +354,155 @@ def test_reapply_is_stable(env):
     assert (env.install / "Mods" / "foo.dll").read_text() == "x"
 
 
+def count_hashed(monkeypatch):
+    hashed = []
+    real = files._hash_file
+
+    def spy(path):
+        hashed.append(path)
+        return real(path)
+
+    monkeypatch.setattr(files, "_hash_file", spy)
+    return hashed
+
+
+def test_hash_file_matches_sha256_across_buffers(tmp_path, monkeypatch):
+    monkeypatch.setattr(files, "HASH_BUFFER_SIZE", 7)
+    path = tmp_path / "blob"
+    data = os.urandom(100)
+    path.write_bytes(data)
+
+    assert files._hash_file(path) == hashlib.sha256(data).hexdigest()
+
+
+def test_reapply_hashes_each_unchanged_target_once(env, monkeypatch):
+    ops = [
+        place(env, f"Mods/{name}.dll", source_file(env, f"{name}.dll", name))
+        for name in ("a", "b", "c")
+    ]
+    apply_file_ops(env.steam_dir, ops, [])
+    hashed = count_hashed(monkeypatch)
+
+    apply_file_ops(env.steam_dir, ops, [])
+
+    assert sorted(hashed) == sorted(env.install / "Mods" / f"{n}.dll" for n in "abc")
+
+
+def test_size_mismatch_replaces_target_without_hashing_it(env, monkeypatch):
+    src = source_file(env, "mod.dll", "mine")
+    op = place(env, "mod.dll", src)
+    apply_file_ops(env.steam_dir, [op], [])
+    target = env.install / "mod.dll"
+    target.write_text("a longer replacement")
+    hashed = count_hashed(monkeypatch)
+
+    apply_file_ops(env.steam_dir, [op], [])
+
+    assert target.read_text() == "mine"
+    assert target not in hashed
+
+
+def age(*paths):
+    for path in paths:
+        os.utime(path, ns=(1_000_000_000, 1_000_000_000))
+
+
+def test_settled_target_is_trusted_without_hashing(env, monkeypatch):
+    src = source_file(env, "mod.dll", "mine")
+    age(src)
+    op = place(env, "mod.dll", src)
+    apply_file_ops(env.steam_dir, [op], [])
+    hashed = count_hashed(monkeypatch)
+
+    apply_file_ops(env.steam_dir, [op], [])
+    apply_file_ops(env.steam_dir, [], [])
+
+    assert hashed == []
+    assert not (env.install / "mod.dll").exists()
+
+
+def test_recently_modified_target_state_is_not_recorded(env):
+    src = source_file(env, "mod.dll", "mine")
+
+    apply_file_ops(env.steam_dir, [place(env, "mod.dll", src)], [])
+
+    assert load_files_manifest(env.steam_dir).files[0].target_state is None
+
+
+def test_same_size_edit_with_restored_mtime_is_re_enforced(env):
+    src = source_file(env, "mod.dll", "mine")
+    age(src)
+    op = place(env, "mod.dll", src)
+    apply_file_ops(env.steam_dir, [op], [])
+    target = env.install / "mod.dll"
+
+    target.write_text("edit")
+    age(target)
+    apply_file_ops(env.steam_dir, [op], [])
+
+    assert target.read_text() == "mine"
+
+
+def test_store_sources_are_hashed_once_across_targets(env, monkeypatch):
+    monkeypatch.setattr(
+        "steam_config_patcher.store_hashes.STORE_DIR", os.path.realpath(env.src)
+    )
+    src = source_file(env, "mod.dll", "mine")
+    apply_file_ops(env.steam_dir, [place(env, "a.dll", src)], [])
+    hashed = count_hashed(monkeypatch)
+
+    apply_file_ops(env.steam_dir, [place(env, "b.dll", src)], [])
+
+    assert src not in hashed
+    assert (env.install / "b.dll").read_text() == "mine"
+
+
+def unsupported(src_fd, dst_fd, size):
+    raise OSError(95, "Operation not supported")
+
+
+def test_copy_falls_back_until_a_method_works(tmp_path, monkeypatch):
+    source = tmp_path / "big.pak"
+    data = os.urandom(3 * files.COPY_BUFFER_SIZE + 5)
+    source.write_bytes(data)
+    methods = [(name, unsupported) for name, _ in files._COPY_METHODS[:-1]]
+    monkeypatch.setattr(files, "_COPY_METHODS", (*methods, files._COPY_METHODS[-1]))
+
+    assert files._copy_file(source, tmp_path / "copy") == "read/write"
+    assert (tmp_path / "copy").read_bytes() == data
+
+
+def test_partial_copy_is_discarded_before_falling_back(tmp_path, monkeypatch):
+    source = tmp_path / "mod.dll"
+    source.write_bytes(b"0123456789")
+
+    def short(src_fd, dst_fd, size):
+        os.write(dst_fd, b"garbage")
+        raise OSError(5, "Input/output error")
+
+    methods = (
+        ("reflink", unsupported),
+        ("copy_file_range", short),
+        ("sendfile", files._sendfile),
+    )
+    monkeypatch.setattr(files, "_COPY_METHODS", methods)
+
+    assert files._copy_file(source, tmp_path / "copy") == "sendfile"
+    assert (tmp_path / "copy").read_bytes() == b"0123456789"
+
+
+def test_placement_keeps_source_mtime_and_logs_method(env, caplog):
+    src = source_file(env, "mod.dll", "mine")
+    age(src)
+
+    with caplog.at_level("DEBUG", logger="steam_config_patcher.files"):
+        apply_file_ops(env.steam_dir, [place(env, "mod.dll", src)], [])
+
+    target = env.install / "mod.dll"
+    assert target.stat().st_mtime_ns == src.stat().st_mtime_ns
+    assert any(f"placed {target} using" in r.getMessage() for r in caplog.records)
+
+
 def test_stale_source_file_is_reverted_on_update(env):
     a = source_file(env, "a.dll", "A")
     b = source_file(env, "b.dll", "B")
@@ -440,7 +592,8 @@ def test_orphan_backup_deleted_when_game_uninstalled(env, monkeypatch):
     assert stored.exists()
 
     monkeypatch.setattr(
-        "steam_config_patcher.files.find_app_install_dir", lambda sd, aid: None
+        "steam_config_patcher.steam.SteamLibraryIndex.install_dir",
+        lambda self, aid: None,
     )
     apply_file_ops(env.steam_dir, [], [])
 
@@ -43,6 +43,28 @@ def test_round_trip(tmp_path):
     assert load_files_manifest(steam_dir) == manifest
 
 
+def test_target_state_round_trips_and_tolerates_bad_entries(tmp_path):
+    steam_dir = make_config_dir(tmp_path)
+    save_files_manifest(
+        steam_dir,
+        FilesManifest(
+            files=[
+                ManagedFile(
+                    620, "install", "a.dll", "place", target_state=(1, 2, 3, 4)
+                ),
+                ManagedFile(620, "install", "b.dll", "place"),
+            ]
+        ),
+    )
+    raw = json.loads(files_manifest_path(steam_dir).read_text(encoding="utf-8"))
+    raw["files"][1]["target_state"] = ["x"]
+    files_manifest_path(steam_dir).write_text(json.dumps(raw), encoding="utf-8")
+
+    files = load_files_manifest(steam_dir).files
+
+    assert [entry.target_state for entry in files] == [(1, 2, 3, 4), None]
+
+
 def test_missing_manifest_is_empty(tmp_path):
     steam_dir = make_config_dir(tmp_path)
 
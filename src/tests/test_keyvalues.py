@@ -1,5 +1,9 @@
+import io
+
 import pytest
 
+from steam_config_patcher.fileio import atomic_write
+from steam_config_patcher.formats import keyvalues
 from steam_config_patcher.formats.keyvalues import prepare_keyvalues
 from steam_config_patcher.types import ConfigPatch, Deletion
 from steam_config_patcher.vdf import text
@@ -53,13 +57,19 @@ def make_patch(file_path, data, deletions=()):
 
 
 def apply(patch):
-    data = prepare_keyvalues(patch)
-    if data is None:
+    write = prepare_keyvalues(patch)
+    if write is None:
         return False
-    patch.file_path.write_bytes(data)
+    atomic_write(patch.file_path, write)
     return True
 
 
+def render(write):
+    buffer = io.BytesIO()
+    write(buffer)
+    return buffer.getvalue()
+
+
 def find_value(kv, key_path):
     values = [node.value for node in kv.find_all(*key_path)]
     assert len(values) == 1, f"expected exactly one value at {key_path}"
@@ -241,3 +251,63 @@ def test_deletion_of_missing_key_is_noop(tmp_path):
     assert prepare_keyvalues(patch) is None
 
     assert path.read_text(encoding="utf-8") == CONFIG_VDF
+
+
+def test_batched_writes_and_deletions_match_sequential_output(tmp_path):
+    path = write_config(tmp_path)
+    data = nest(
+        MAPPING_PATH,
+        {
+            str(app_id): {"config": "", "name": f"tool-{app_id}", "priority": "250"}
+            for app_id in range(100, 110)
+        },
+    )
+    deletions = [
+        Deletion(
+            key_path=MAPPING_PATH + ("0",),
+            guard_path=("name",),
+            expected="proton_experimental",
+        ),
+        Deletion(key_path=STEAM_PATH + ("AutoUpdateWindowEnabled",)),
+    ]
+    patch = make_patch(path, data, deletions)
+
+    expected = parse(path)
+    assert keyvalues.apply_sequentially(expected, patch)
+
+    assert render(prepare_keyvalues(patch)) == text.dumps(expected).encode("utf-8")
+
+
+def test_nested_deletions_fall_back_to_sequential_order(tmp_path):
+    path = write_config(tmp_path)
+    deletions = [
+        Deletion(key_path=MAPPING_PATH + ("0", "name")),
+        Deletion(
+            key_path=MAPPING_PATH + ("0",),
+            guard_path=("name",),
+            expected="proton_experimental",
+        ),
+    ]
+    patch = make_patch(path, {}, deletions)
+
+    assert keyvalues.build_patch_trie(patch) is None
+    assert apply(patch)
+
+    kv = parse(path)
+    assert list(kv.find_all(*MAPPING_PATH, "0", "name")) == []
+    assert find_value(kv, MAPPING_PATH + ("0", "priority")) == "75"
+
+
+def test_untouched_regions_are_written_back_verbatim(tmp_path):
+    path = tmp_path / "config.vdf"
+    original = CONFIG_VDF.replace(
+        '"AutoUpdateWindowEnabled"', "// keep me\n\t\t\t\tAutoUpdateWindowEnabled"
+    )
+    path.write_text(original, encoding="utf-8")
+    patch = make_patch(path, nest(MAPPING_PATH + ("0", "name"), "GE-Proton"))
+
+    assert apply(patch)
+
+    assert path.read_text(encoding="utf-8") == original.replace(
+        '"proton_experimental"', '"GE-Proton"'
+    )
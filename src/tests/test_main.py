@@ -69,6 +69,22 @@ def test_apps_translate_to_launch_options_and_compat_tools(tmp_path, monkeypatch
         assert user.launch_options == {1091500: "wrapper %command%"}
 
 
+def test_users_share_one_read_only_config(tmp_path, monkeypatch):
+    data = base_input(
+        apps={"portal": {"id": 620, "launchOptions": "wrapper %command%"}},
+        nonSteamApps={"game": non_steam_app_input()},
+    )
+
+    cfg = run_parse(tmp_path, monkeypatch, data)
+
+    first, second = (cfg.users[user_id] for user_id in USER_IDS)
+    assert first is second
+    with pytest.raises(TypeError):
+        first.launch_options[620] = "other"
+    with pytest.raises(TypeError):
+        first.non_steam_apps[1] = first.non_steam_apps[2434605777]
+
+
 def test_default_compat_tool_maps_to_id_zero_with_low_priority(tmp_path, monkeypatch):
     data = base_input(defaultCompatTool="GE-Proton")
 
@@ -258,6 +274,27 @@ def test_strategy_and_steam_dir_are_passed_through(tmp_path, monkeypatch):
     assert cfg.steam_dir == tmp_path / "steam"
 
 
+def test_prepare_jobs_defaults_to_sequential(tmp_path, monkeypatch):
+    assert run_parse(tmp_path, monkeypatch, base_input()).prepare_jobs == 1
+
+
+def test_prepare_jobs_passed_through(tmp_path, monkeypatch):
+    cfg = run_parse(tmp_path, monkeypatch, base_input(prepareJobs=4))
+
+    assert cfg.prepare_jobs == 4
+
+
+def test_compact_shortcuts_passed_through(tmp_path, monkeypatch):
+    cfg = run_parse(tmp_path, monkeypatch, base_input(compactShortcuts=True))
+
+    assert cfg.compact_shortcuts is True
+
+
+def test_prepare_jobs_must_be_positive(tmp_path, monkeypatch):
+    with pytest.raises(ValidationError):
+        run_parse(tmp_path, monkeypatch, base_input(prepareJobs=0))
+
+
 def test_unknown_strategy_raises(tmp_path, monkeypatch):
     with pytest.raises(ValidationError):
         run_parse(tmp_path, monkeypatch, base_input(onSteamRunning="sometimes"))
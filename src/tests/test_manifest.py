@@ -6,6 +6,7 @@ from steam_config_patcher.types import (
     CONFIG_FILE,
     LOCALCONFIG_APPS_PATH,
     LOCALCONFIG_FILE,
+    FileFingerprint,
     ManagedKey,
     UserManifest,
 )
@@ -50,6 +51,56 @@ def test_round_trip(tmp_path):
     assert load_manifest(steam_dir, 111) == manifest
 
 
+def test_loaded_keys_share_interned_paths(tmp_path):
+    steam_dir = make_user_dir(tmp_path)
+    save_manifest(
+        steam_dir,
+        111,
+        UserManifest(managed_keys=[compat_key(620, "a"), compat_key(620, "b")]),
+    )
+
+    first, second = load_manifest(steam_dir, 111).managed_keys
+
+    assert first.key_path is second.key_path
+    assert first.file is second.file
+    assert not hasattr(first, "__dict__")
+
+
+def test_fingerprints_round_trip(tmp_path):
+    steam_dir = make_user_dir(tmp_path)
+    fingerprint = FileFingerprint(
+        size=12, mtime_ns=1700000000123456789, digest="ab" * 16, patch_digest="cd" * 16
+    )
+
+    save_manifest(
+        steam_dir, 111, UserManifest(fingerprints={"/steam/config.vdf": fingerprint})
+    )
+
+    assert load_manifest(steam_dir, 111).fingerprints == {
+        "/steam/config.vdf": fingerprint
+    }
+
+
+def test_malformed_fingerprints_are_dropped(tmp_path):
+    steam_dir = make_user_dir(tmp_path)
+    manifest_path(steam_dir, 111).write_text(
+        json.dumps(
+            {
+                "version": 2,
+                "fingerprints": {
+                    "/a": {"size": 1, "mtime_ns": 2, "digest": "x", "patch": "y"},
+                    "/b": {"size": "nope"},
+                },
+            }
+        ),
+        encoding="utf-8",
+    )
+
+    assert load_manifest(steam_dir, 111).fingerprints == {
+        "/a": FileFingerprint(1, 2, "x", "y")
+    }
+
+
 def test_saved_file_is_versioned_json(tmp_path):
     steam_dir = make_user_dir(tmp_path)
 
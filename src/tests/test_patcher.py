@@ -1,10 +1,13 @@
 import json
+import os
 
 import pytest
 
+from steam_config_patcher import patcher
 from steam_config_patcher.files_manifest import load_files_manifest
 from steam_config_patcher.manifest import load_manifest, manifest_path
 from steam_config_patcher.patcher import (
+    ManagedKeyIndex,
     desired_manifest,
     generate_config_vdf_patch,
     generate_shortcuts_vdf_patch,
@@ -12,6 +15,7 @@ from steam_config_patcher.patcher import (
 )
 from steam_config_patcher.types import (
     CompatToolConfig,
+    ConfigPatch,
     FileOp,
     GridArt,
     ManagedKey,
@@ -112,9 +116,13 @@ def make_cfg(
     grid_art=None,
     file_ops=None,
     remove_ops=None,
+    prepare_jobs=1,
+    compact_shortcuts=False,
 ):
     return PatcherConfig(
         on_steam_running=on_steam_running,
+        prepare_jobs=prepare_jobs,
+        compact_shortcuts=compact_shortcuts,
         steam_dir=steam_dir,
         game_betas=game_betas or {},
         game_languages=game_languages or {},
@@ -216,6 +224,22 @@ def test_config_vdf_patch_dedupes_prev_keys_across_users(tmp_path):
     assert len(patch.deletions) == 1
 
 
+def test_prev_keys_grouped_once_give_the_same_deletions(tmp_path):
+    steam_dir = make_steam_dir(tmp_path)
+    cfg = make_cfg(steam_dir, compat_tool_mapping={620: CompatToolConfig("GE-Proton", 250)})
+    prev_keys = [
+        compat_key(620, "GE-Proton"),
+        compat_key(999, "first"),
+        ManagedKey(file="localconfig", key_path=APPS_PATH + ("1", "LaunchOptions")),
+        compat_key(999, "second"),
+    ]
+
+    grouped = generate_config_vdf_patch(cfg, ManagedKeyIndex(prev_keys))
+
+    assert grouped.deletions == generate_config_vdf_patch(cfg, prev_keys).deletions
+    assert [(d.key_path[-1], d.expected) for d in grouped.deletions] == [("999", "first")]
+
+
 def test_shortcuts_patch_reuses_index_for_existing_appid(fake_steam, tmp_path):
     steam_dir = make_steam_dir(tmp_path)
     path = steam_dir / "userdata" / str(USER_ID) / "config" / "shortcuts.vdf"
@@ -273,6 +297,90 @@ def test_shortcuts_patch_deletes_removed_appids(fake_steam, tmp_path):
     assert [d.key_path for d in patch.deletions] == [("shortcuts", "0")]
 
 
+def test_shortcuts_patch_keeps_lowest_index_for_duplicate_appid(fake_steam, tmp_path):
+    steam_dir = make_steam_dir(tmp_path)
+    path = steam_dir / "userdata" / str(USER_ID) / "config" / "shortcuts.vdf"
+    path.write_bytes(
+        binary.dumps({"shortcuts": {"3": {"appid": 777}, "1": {"appid": 777}}})
+    )
+    cfg = make_cfg(steam_dir, non_steam_apps={777: non_steam_app()})
+
+    patch = generate_shortcuts_vdf_patch(cfg, USER_ID, cfg.users[USER_ID], UserManifest())
+
+    assert list(patch.data["shortcuts"]) == ["1"]
+
+
+def test_compact_shortcuts_renumbers_densely(fake_steam, tmp_path):
+    steam_dir = make_steam_dir(tmp_path)
+    path = steam_dir / "userdata" / str(USER_ID) / "config" / "shortcuts.vdf"
+    path.write_bytes(
+        binary.dumps(
+            {
+                "shortcuts": {
+                    "0": {"appid": 555, "AppName": "Removed", "LastPlayTime": 5},
+                    "2": {"appid": 777, "AppName": "Foreign", "tags": {"0": "fav"}},
+                    "5": {"appid": 888, "AppName": "Ours", "Extra": "kept"},
+                }
+            }
+        )
+    )
+    cfg = make_cfg(
+        steam_dir,
+        non_steam_apps={888: non_steam_app(name="Ours"), 999: non_steam_app(name="New")},
+        compact_shortcuts=True,
+    )
+    manifest_path(steam_dir, USER_ID).write_text(
+        json.dumps({"version": 2, "shortcuts": [555, 888]}), encoding="utf-8"
+    )
+
+    patch_config_files(cfg)
+
+    shortcuts = read_shortcuts(steam_dir)["shortcuts"]
+    assert list(shortcuts) == ["0", "1", "2"]
+    assert shortcuts["0"] == {"appid": 777, "AppName": "Foreign", "tags": {"0": "fav"}}
+    assert shortcuts["1"]["AppName"] == "Ours"
+    assert shortcuts["1"]["Extra"] == "kept"
+    assert shortcuts["2"]["AppName"] == "New"
+    assert "LastPlayTime" not in shortcuts["0"]
+
+    again = generate_shortcuts_vdf_patch(
+        cfg, USER_ID, cfg.users[USER_ID], load_manifest(steam_dir, USER_ID)
+    )
+    assert patcher.prepare_patch(again) is None
+
+
+def test_compact_shortcuts_keeps_both_entries_sharing_an_app_id(fake_steam, tmp_path):
+    steam_dir = make_steam_dir(tmp_path)
+    path = steam_dir / "userdata" / str(USER_ID) / "config" / "shortcuts.vdf"
+    path.write_bytes(
+        binary.dumps(
+            {
+                "shortcuts": {
+                    "1": {"appid": 777, "AppName": "X"},
+                    "3": {"appid": 777, "AppName": "Y"},
+                }
+            }
+        )
+    )
+    cfg = make_cfg(
+        steam_dir, non_steam_apps={777: non_steam_app(name="Ours")}, compact_shortcuts=True
+    )
+
+    patch_config_files(cfg)
+    first = read_shortcuts(steam_dir)["shortcuts"]
+    patch_config_files(cfg)
+    second = read_shortcuts(steam_dir)["shortcuts"]
+
+    assert list(first) == ["0", "1"]
+    assert [s["AppName"] for s in first.values()] == ["Ours", "Y"]
+    assert second == first
+    assert list(second) == ["0", "1"]
+    again = generate_shortcuts_vdf_patch(
+        cfg, USER_ID, cfg.users[USER_ID], load_manifest(steam_dir, USER_ID)
+    )
+    assert patcher.prepare_patch(again) is None
+
+
 def test_shortcuts_patch_missing_file_creates_shortcut(fake_steam, tmp_path):
     steam_dir = make_steam_dir(tmp_path)
     (steam_dir / "userdata" / str(USER_ID) / "config" / "shortcuts.vdf").unlink()
@@ -756,7 +864,7 @@ def test_vdf_write_failure_does_not_block_file_ops(fake_steam, tmp_path, monkeyp
     def boom(*args, **kwargs):
         raise OSError("disk full")
 
-    monkeypatch.setattr("steam_config_patcher.patcher.atomic_write_bytes", boom)
+    monkeypatch.setattr("steam_config_patcher.patcher.atomic_write", boom)
 
     with pytest.raises(SystemExit):
         patch_config_files(cfg)
@@ -895,3 +1003,172 @@ def test_failing_file_does_not_stop_others(fake_steam, tmp_path):
     assert find_values(localconfig_vdf, APPS_PATH + ("620", "LaunchOptions")) == [
         "wrapper %command%"
     ]
+
+
+def test_concurrent_prepare_matches_sequential(fake_steam, tmp_path):
+    results = []
+    for prepare_jobs in (1, 4):
+        steam_dir = make_steam_dir(tmp_path / str(prepare_jobs))
+        write_app_manifest(steam_dir)
+        cfg = make_cfg(
+            steam_dir,
+            compat_tool_mapping={1091500: CompatToolConfig("GE-Proton", 250)},
+            launch_options={620: "wrapper %command%"},
+            non_steam_apps={555: non_steam_app(name="Game")},
+            game_languages={1091500: "german"},
+            prepare_jobs=prepare_jobs,
+        )
+
+        patch_config_files(cfg)
+
+        results.append(
+            sorted(
+                (path.relative_to(steam_dir).as_posix(), path.read_bytes())
+                for path in steam_dir.rglob("*")
+                if path.is_file() and not path.name.startswith("steam-config-nix")
+            )
+        )
+
+    assert results[0] == results[1]
+
+
+def test_concurrent_prepare_reports_failures_per_step(fake_steam, tmp_path):
+    steam_dir = make_steam_dir(tmp_path)
+    (steam_dir / "config" / "config.vdf").write_text('"broken', encoding="utf-8")
+    cfg = make_cfg(
+        steam_dir,
+        compat_tool_mapping={1091500: CompatToolConfig("GE-Proton", 250)},
+        launch_options={620: "wrapper %command%"},
+        prepare_jobs=4,
+    )
+
+    with pytest.raises(SystemExit, match="^1 config file"):
+        patch_config_files(cfg)
+
+    localconfig_vdf = steam_dir / "userdata" / str(USER_ID) / "config" / "localconfig.vdf"
+    assert find_values(localconfig_vdf, APPS_PATH + ("620", "LaunchOptions")) == [
+        "wrapper %command%"
+    ]
+
+
+def age_files(steam_dir):
+    for path in steam_dir.rglob("*"):
+        if path.is_file():
+            os.utime(path, ns=(0, 0))
+
+
+def test_wait_reprepares_only_files_steam_changed(fake_steam, tmp_path, monkeypatch):
+    fake_steam.running = True
+    steam_dir = make_steam_dir(tmp_path)
+    age_files(steam_dir)
+    config_vdf = steam_dir / "config" / "config.vdf"
+    steam_exit_vdf = CONFIG_VDF.replace(
+        "\t\t\t\t{\n\t\t\t\t}", '\t\t\t\t{\n\t\t\t\t}\n\t\t\t\t"Exit"\t\t"1"'
+    )
+    fake_steam.on_wait = lambda: config_vdf.write_text(steam_exit_vdf, encoding="utf-8")
+
+    calls = []
+    for name in ("generate_config_vdf_patch", "generate_localconfig_vdf_patch"):
+        real = getattr(patcher, name)
+        monkeypatch.setattr(
+            patcher,
+            name,
+            lambda *args, name=name, real=real: calls.append(name) or real(*args),
+        )
+    cfg = make_cfg(
+        steam_dir,
+        compat_tool_mapping={1091500: CompatToolConfig("GE-Proton", 250)},
+        launch_options={620: "wrapper %command%"},
+    )
+
+    patch_config_files(cfg)
+
+    assert calls.count("generate_config_vdf_patch") == 2
+    assert calls.count("generate_localconfig_vdf_patch") == 1
+    steam_path = ("InstallConfigStore", "Software", "Valve", "Steam")
+    assert find_values(config_vdf, steam_path + ("Exit",)) == ["1"]
+    assert find_values(config_vdf, MAPPING_PATH + ("1091500", "name")) == ["GE-Proton"]
+    localconfig_vdf = steam_dir / "userdata" / str(USER_ID) / "config" / "localconfig.vdf"
+    assert find_values(localconfig_vdf, APPS_PATH + ("620", "LaunchOptions")) == [
+        "wrapper %command%"
+    ]
+
+
+def test_recently_modified_files_are_reprepared(fake_steam, tmp_path, monkeypatch):
+    fake_steam.running = True
+    steam_dir = make_steam_dir(tmp_path)
+    calls = []
+    real = patcher.generate_localconfig_vdf_patch
+    monkeypatch.setattr(
+        patcher,
+        "generate_localconfig_vdf_patch",
+        lambda *args: calls.append(args) or real(*args),
+    )
+    cfg = make_cfg(steam_dir, launch_options={620: "wrapper %command%"})
+
+    patch_config_files(cfg)
+
+    assert len(calls) == 2
+
+
+def count_prepared(monkeypatch):
+    prepared = []
+    real = patcher.prepare_patch
+    monkeypatch.setattr(
+        patcher,
+        "prepare_patch",
+        lambda config_patch: prepared.append(config_patch.file_path.name)
+        or real(config_patch),
+    )
+    return prepared
+
+
+def test_unchanged_files_are_skipped_on_next_run(fake_steam, tmp_path, monkeypatch):
+    steam_dir = make_steam_dir(tmp_path)
+    cfg = make_cfg(
+        steam_dir,
+        compat_tool_mapping={1091500: CompatToolConfig("GE-Proton", 250)},
+        launch_options={620: "wrapper %command%"},
+    )
+    patch_config_files(cfg)
+    age_files(steam_dir)
+    patch_config_files(cfg)
+    prepared = count_prepared(monkeypatch)
+
+    patch_config_files(cfg)
+
+    assert prepared == []
+
+
+def test_changed_file_or_patch_is_prepared_again(fake_steam, tmp_path, monkeypatch):
+    steam_dir = make_steam_dir(tmp_path)
+    cfg = make_cfg(
+        steam_dir,
+        compat_tool_mapping={1091500: CompatToolConfig("GE-Proton", 250)},
+        launch_options={620: "wrapper %command%"},
+    )
+    patch_config_files(cfg)
+    age_files(steam_dir)
+    patch_config_files(cfg)
+    config_vdf = steam_dir / "config" / "config.vdf"
+    stat = config_vdf.stat()
+    # same size and mtime, only the content hash gives the change away
+    config_vdf.write_bytes(config_vdf.read_bytes().replace(b"GE-Proton", b"GE-Protom"))
+    os.utime(config_vdf, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    cfg.users[USER_ID].launch_options[620] = "other %command%"
+    prepared = count_prepared(monkeypatch)
+
+    patch_config_files(cfg)
+
+    assert sorted(prepared) == ["config.vdf", "localconfig.vdf"]
+    assert find_values(config_vdf, MAPPING_PATH + ("1091500", "name")) == ["GE-Proton"]
+
+
+def test_patch_digest_covers_replaced_paths(tmp_path):
+    data = {"shortcuts": {"0": {"appid": 777}}}
+    merged = ConfigPatch(tmp_path / "shortcuts.vdf", "binary-keyvalues", data)
+    replacing = ConfigPatch(
+        tmp_path / "shortcuts.vdf", "binary-keyvalues", data, replaced=[("shortcuts",)]
+    )
+
+    assert patcher.patch_digest(merged) != patcher.patch_digest(replacing)
@@ -4,10 +4,8 @@ from types import SimpleNamespace
 import pytest
 
 from steam_config_patcher.steam import (
+    SteamLibraryIndex,
     close_steam,
-    find_app_compat_prefix,
-    find_app_install_dir,
-    find_app_manifest,
     game_is_running,
     get_steam_dir,
     get_steam_user_ids,
@@ -100,10 +98,18 @@ def test_steam_dir_missing_raises(tmp_path, monkeypatch):
         get_steam_dir()
 
 
-def write_libraryfolders(steam_dir, library_paths):
+def write_libraryfolders(steam_dir, library_paths, apps=None):
     (steam_dir / "config").mkdir(parents=True, exist_ok=True)
+    apps = apps or {}
+
+    def apps_block(path):
+        if path not in apps:
+            return ""
+        entries = "".join(f'\t\t\t"{app_id}"\t\t"0"\n' for app_id in apps[path])
+        return f'\t\t"apps"\n\t\t{{\n{entries}\t\t}}\n'
+
     blocks = "".join(
-        f'\t"{index}"\n\t{{\n\t\t"path"\t\t"{path}"\n\t}}\n'
+        f'\t"{index}"\n\t{{\n\t\t"path"\t\t"{path}"\n{apps_block(path)}\t}}\n'
         for index, path in enumerate(library_paths)
     )
     (steam_dir / "config" / "libraryfolders.vdf").write_text(
@@ -126,7 +132,7 @@ def test_library_paths_without_libraryfolders(tmp_path):
     assert steam_library_paths(steam_dir) == [steam_dir]
 
 
-def test_find_app_manifest_searches_all_libraries(tmp_path):
+def test_library_index_manifest_searches_all_libraries(tmp_path):
     steam_dir = tmp_path / "steam"
     extra = tmp_path / "drive"
     write_libraryfolders(steam_dir, [steam_dir, extra])
@@ -134,14 +140,14 @@ def test_find_app_manifest_searches_all_libraries(tmp_path):
     manifest.parent.mkdir(parents=True)
     manifest.touch()
 
-    assert find_app_manifest(steam_dir, 620) == manifest
+    assert SteamLibraryIndex(steam_dir).manifest(620) == manifest
 
 
-def test_find_app_manifest_missing_returns_none(tmp_path):
+def test_library_index_manifest_missing_returns_none(tmp_path):
     steam_dir = tmp_path / "steam"
     (steam_dir / "steamapps").mkdir(parents=True)
 
-    assert find_app_manifest(steam_dir, 620) is None
+    assert SteamLibraryIndex(steam_dir).manifest(620) is None
 
 
 def write_appmanifest(library, app_id, installdir):
@@ -155,7 +161,7 @@ def write_appmanifest(library, app_id, installdir):
     return manifest
 
 
-def test_find_app_install_dir_resolves_common_path(tmp_path):
+def test_library_index_install_dir_resolves_common_path(tmp_path):
     steam_dir = tmp_path / "steam"
     extra = tmp_path / "drive"
     write_libraryfolders(steam_dir, [steam_dir, extra])
@@ -163,40 +169,40 @@ def test_find_app_install_dir_resolves_common_path(tmp_path):
     install_dir = extra / "steamapps" / "common" / "Portal 2"
     install_dir.mkdir(parents=True)
 
-    assert find_app_install_dir(steam_dir, 620) == install_dir
+    assert SteamLibraryIndex(steam_dir).install_dir(620) == install_dir
 
 
-def test_find_app_install_dir_missing_manifest_returns_none(tmp_path):
+def test_library_index_install_dir_missing_manifest_returns_none(tmp_path):
     steam_dir = tmp_path / "steam"
     (steam_dir / "steamapps").mkdir(parents=True)
 
-    assert find_app_install_dir(steam_dir, 620) is None
+    assert SteamLibraryIndex(steam_dir).install_dir(620) is None
 
 
-def test_find_app_install_dir_uninstalled_common_returns_none(tmp_path):
+def test_library_index_install_dir_uninstalled_common_returns_none(tmp_path):
     steam_dir = tmp_path / "steam"
     write_libraryfolders(steam_dir, [steam_dir])
     write_appmanifest(steam_dir, 620, "Portal 2")
 
-    assert find_app_install_dir(steam_dir, 620) is None
+    assert SteamLibraryIndex(steam_dir).install_dir(620) is None
 
 
-def test_find_app_compat_prefix_resolves_pfx(tmp_path):
+def test_library_index_compat_prefix_resolves_pfx(tmp_path):
     steam_dir = tmp_path / "steam"
     write_libraryfolders(steam_dir, [steam_dir])
     write_appmanifest(steam_dir, 620, "Portal 2")
     prefix = steam_dir / "steamapps" / "compatdata" / "620" / "pfx"
     prefix.mkdir(parents=True)
 
-    assert find_app_compat_prefix(steam_dir, 620) == prefix
+    assert SteamLibraryIndex(steam_dir).compat_prefix(620) == prefix
 
 
-def test_find_app_compat_prefix_unlaunched_returns_none(tmp_path):
+def test_library_index_compat_prefix_unlaunched_returns_none(tmp_path):
     steam_dir = tmp_path / "steam"
     write_libraryfolders(steam_dir, [steam_dir])
     write_appmanifest(steam_dir, 620, "Portal 2")
 
-    assert find_app_compat_prefix(steam_dir, 620) is None
+    assert SteamLibraryIndex(steam_dir).compat_prefix(620) is None
 
 
 def test_user_ids_are_numeric_dirs_excluding_zero(tmp_path):
@@ -322,3 +328,60 @@ def test_wait_for_steam_exit_returns_without_closing(fake_system):
     assert not proc.terminated
     assert not proc.killed
     assert fake_system.commands == []
+
+
+def test_library_index_prefers_earlier_library(tmp_path):
+    steam_dir = tmp_path / "steam"
+    extra = tmp_path / "drive"
+    write_libraryfolders(steam_dir, [steam_dir, extra])
+    first = write_appmanifest(steam_dir, 620, "Portal 2")
+    write_appmanifest(extra, 620, "Portal 2")
+    write_appmanifest(extra, 400, "Portal")
+
+    libraries = SteamLibraryIndex(steam_dir)
+
+    assert libraries.manifest(620) == first
+    assert libraries.manifest(400) == extra / "steamapps" / "appmanifest_400.acf"
+    assert libraries.manifest(70) is None
+
+
+def test_library_index_lists_each_library_once(tmp_path, monkeypatch):
+    steam_dir = tmp_path / "steam"
+    write_libraryfolders(steam_dir, [steam_dir])
+    write_appmanifest(steam_dir, 620, "Portal 2")
+    (steam_dir / "steamapps" / "common" / "Portal 2").mkdir(parents=True)
+    scanned = []
+    real_scandir = os.scandir
+    monkeypatch.setattr(
+        "steam_config_patcher.steam.os.scandir",
+        lambda path: scanned.append(path) or real_scandir(path),
+    )
+
+    libraries = SteamLibraryIndex(steam_dir)
+    for _ in range(3):
+        assert libraries.install_dir(620) is not None
+        assert libraries.compat_prefix(620) is None
+
+    assert scanned == [steam_dir / "steamapps"]
+
+
+def test_library_index_uses_apps_tables_without_listing(tmp_path, monkeypatch):
+    steam_dir = tmp_path / "steam"
+    extra = tmp_path / "drive"
+    write_libraryfolders(steam_dir, [steam_dir, extra], apps={extra: [620]})
+    manifest = write_appmanifest(extra, 620, "Portal 2")
+    monkeypatch.setattr(
+        "steam_config_patcher.steam.os.scandir",
+        lambda path: pytest.fail(f"listed {path}"),
+    )
+
+    assert SteamLibraryIndex(steam_dir).manifest(620) == manifest
+
+
+def test_library_index_falls_back_when_apps_table_is_stale(tmp_path):
+    steam_dir = tmp_path / "steam"
+    extra = tmp_path / "drive"
+    write_libraryfolders(steam_dir, [steam_dir, extra], apps={steam_dir: [620]})
+    manifest = write_appmanifest(extra, 620, "Portal 2")
+
+    assert SteamLibraryIndex(steam_dir).manifest(620) == manifest
@@ -0,0 +1,89 @@
+import hashlib
+import os
+
+import pytest
+
+from steam_config_patcher import store_hashes
+from steam_config_patcher.store_hashes import StoreHashCache
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store_dir = tmp_path / "store"
+    store_dir.mkdir()
+    monkeypatch.setattr(store_hashes, "STORE_DIR", os.path.realpath(store_dir))
+    return store_dir
+
+
+def store_file(store, name, content):
+    path = store / name
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(content)
+    return path, hashlib.sha256(content).hexdigest()
+
+
+def test_round_trip(tmp_path, store):
+    path, digest = store_file(store, "abc-mod/mod.dll", b"data")
+    cache = StoreHashCache(tmp_path / "hashes.bin")
+    cache.update({path: digest})
+    cache.save()
+
+    assert StoreHashCache(tmp_path / "hashes.bin").lookup([path]) == {path: digest}
+
+
+def test_paths_outside_store_are_not_cached(tmp_path, store):
+    path = tmp_path / "mod.dll"
+    path.write_bytes(b"data")
+    cache = StoreHashCache(tmp_path / "hashes.bin")
+
+    cache.update({path: hashlib.sha256(b"data").hexdigest()})
+
+    assert cache.get(path) is None
+    assert not cache.dirty
+
+
+def test_rebuilt_path_is_a_miss(tmp_path, store):
+    path, digest = store_file(store, "abc-mod/mod.dll", b"data")
+    cache = StoreHashCache(tmp_path / "hashes.bin")
+    cache.update({path: digest})
+
+    rebuilt = path.with_name("rebuilt")
+    rebuilt.write_bytes(b"atad")
+    os.replace(rebuilt, path)
+
+    assert cache.get(path) is None
+
+
+def test_links_into_store_are_keyed_by_store_path(tmp_path, store):
+    first, first_digest = store_file(store, "abc-mod/mod.dll", b"data")
+    second, _ = store_file(store, "def-mod/mod.dll", b"atad")
+    link = tmp_path / "current-mod.dll"
+    link.symlink_to(first)
+    cache = StoreHashCache(tmp_path / "hashes.bin")
+    cache.update({link: first_digest})
+
+    assert list(cache.entries) == [os.path.realpath(first)]
+    assert cache.get(first) == first_digest
+
+    link.unlink()
+    link.symlink_to(second)
+
+    assert cache.get(link) is None
+
+
+def test_collected_paths_are_dropped_on_save(tmp_path, store):
+    kept, kept_digest = store_file(store, "abc-mod/a.dll", b"a")
+    gone, gone_digest = store_file(store, "abc-mod/b.dll", b"b")
+    cache = StoreHashCache(tmp_path / "hashes.bin")
+    cache.update({kept: kept_digest, gone: gone_digest})
+    gone.unlink()
+
+    cache.save()
+
+    assert list(StoreHashCache(tmp_path / "hashes.bin").entries) == [str(kept)]
+
+
+def test_corrupt_cache_is_ignored(tmp_path, store):
+    (tmp_path / "hashes.bin").write_bytes(b"SCNH\x01\x00\x00\x00\xff\xff")
+
+    assert StoreHashCache(tmp_path / "hashes.bin").entries == {}
@@ -2,13 +2,15 @@ import struct
 
 import pytest
 
-from steam_config_patcher.vdf import binary
+from steam_config_patcher.vdf import appinfo, binary
 from steam_config_patcher.vdf.appinfo import (
     MAGIC_V40,
     MAGIC_V41,
     AppInfoError,
     icon_hash,
+    index_path,
     load_common,
+    load_common_file,
 )
 
 _APP_HEADER_AFTER_SIZE = 4 + 4 + 8 + 20 + 4 + 20
@@ -122,3 +124,46 @@ def test_icon_hash_none_when_absent():
 def test_unsupported_version_is_rejected():
     with pytest.raises(AppInfoError):
         load_common(struct.pack("<II", 0x07564427, 1))
+
+
+def test_load_common_file_builds_and_reuses_index(tmp_path):
+    path = tmp_path / "appinfo.vdf"
+    path.write_bytes(_build_v41(APPS))
+
+    assert load_common_file(path, {438100})[438100]["name"] == "VRChat"
+    assert index_path(path).is_file()
+
+    cached = index_path(path).read_bytes()
+    assert set(load_common_file(path, {1091500, 1})) == {1091500}
+    assert index_path(path).read_bytes() == cached
+
+
+def test_load_common_file_rebuilds_stale_index(tmp_path):
+    path = tmp_path / "appinfo.vdf"
+    path.write_bytes(_build_v40(APPS))
+    load_common_file(path, {438100})
+
+    path.write_bytes(_build_v40({620: {"name": "Portal", "icon": "abc"}}))
+
+    assert load_common_file(path, {620, 438100}) == {620: {"name": "Portal", "icon": "abc"}}
+
+
+def test_v41_string_table_decodes_only_referenced_entries():
+    data = _build_v41(APPS)
+    header_size = struct.calcsize("<II")
+    (table_offset,) = struct.unpack_from("<q", data, header_size)
+    table = appinfo._StringTable(data, table_offset)
+
+    assert len(table) > 3
+    assert table[1] == "common"
+    assert table[0] == "appinfo"
+    assert set(table.strings) == {0, 1}
+    with pytest.raises(IndexError):
+        table[len(table)]
+
+
+@pytest.mark.parametrize("build", [_build_v40, _build_v41])
+def test_keys_project_common_blocks(build):
+    result = load_common(build(APPS), keys=("icon", "missing"))
+
+    assert result == {438100: {"icon": "aaa111"}, 1091500: {"icon": "ccc333"}}
@@ -4,8 +4,10 @@ from steam_config_patcher.vdf.binary import (
     BinaryVdfError,
     Int64,
     Uint64,
+    dump,
     dumps,
     loads,
+    read_block,
 )
 
 GOLDEN_DATA = {
@@ -31,6 +33,14 @@ def test_dumps_matches_valve_python_vdf_output():
     assert dumps(GOLDEN_DATA) == GOLDEN_BYTES
 
 
+def test_dump_writes_the_same_bytes_to_a_file(tmp_path):
+    path = tmp_path / "shortcuts.vdf"
+    with path.open("wb") as f:
+        dump(GOLDEN_DATA, f)
+
+    assert path.read_bytes() == GOLDEN_BYTES
+
+
 def test_loads_golden_bytes():
     assert loads(GOLDEN_BYTES) == GOLDEN_DATA
 
@@ -91,6 +101,38 @@ def test_alt_end_byte_closes_dict():
     assert loads(b"\x00d\x00\x0b\x08") == {"d": {}}
 
 
+def test_lossless_loads_records_dict_spans():
+    document = loads(GOLDEN_BYTES, lossless=True)
+
+    assert document == GOLDEN_DATA
+    start, end = document.spans[("shortcuts", "0")]
+    assert GOLDEN_BYTES[start:end].startswith(b"\x000\x00\x02appid")
+    assert loads(b"\x00s\x00" + GOLDEN_BYTES[start:end] + b"\x08") == {
+        "s": {"0": GOLDEN_DATA["shortcuts"]["0"]}
+    }
+
+
+def test_dumps_copies_unchanged_dicts_from_source():
+    # the alt end byte would be rewritten as 0x08 if the dict were re-encoded
+    source = b"\x00a\x00\x01k\x00v\x00\x0b\x00b\x00\x01k\x00v\x00\x0b\x08"
+    document = loads(source, lossless=True)
+    document["b"]["k"] = "w"
+
+    result = dumps(document, changed={("b", "k")})
+
+    assert result == (
+        b"\x00a\x00\x01k\x00v\x00\x0b\x00b\x00\x01k\x00w\x00\x08\x08"
+    )
+
+
+def test_dumps_reencodes_replaced_dicts():
+    source = b"\x00a\x00\x00b\x00\x01k\x00v\x00\x0b\x0b\x08"
+    document = loads(source, lossless=True)
+    document["a"] = {"b": {"k": "w"}}
+
+    assert dumps(document, changed={("a",)}) == dumps({"a": {"b": {"k": "w"}}})
+
+
 def test_trailing_data_is_rejected():
     with pytest.raises(BinaryVdfError):
         loads(GOLDEN_BYTES + b"\x00")
@@ -115,3 +157,24 @@ def test_unsupported_python_type_is_rejected():
 def test_null_byte_in_string_is_rejected():
     with pytest.raises(BinaryVdfError):
         dumps({"d": {"k": "a\x00b"}})
+
+
+def test_deeply_nested_dicts_do_not_hit_recursion_limit():
+    depth = 5000
+    data = b"\x00d\x00" * depth + b"\x08" * (depth + 1)
+
+    result = loads(data)
+
+    for _ in range(depth):
+        result = result["d"]
+    assert result == {}
+
+
+def test_read_block_projection_skips_unrequested_keys():
+    data = dumps({"d": {"keep": {"a": 1, "b": "x"}, "drop": {"c": Uint64(1)}, "k": "v"}})
+    body = data[len(b"\x00d\x00") : -1]
+
+    block, offset = read_block(body, 0, projection={"keep": {"b": None}, "k": None})
+
+    assert block == {"keep": {"b": "x"}, "k": "v"}
+    assert offset == len(body)
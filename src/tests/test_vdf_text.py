@@ -1,6 +1,8 @@
+import io
+
 import pytest
 
-from steam_config_patcher.vdf.text import VdfNode, VdfSyntaxError, dumps, loads
+from steam_config_patcher.vdf.text import VdfNode, VdfSyntaxError, dump, dumps, loads
 
 SAMPLE = """\
 "InstallConfigStore"
@@ -136,6 +138,33 @@ def test_remove_deletes_child():
     assert [n.name for n in root.find("Root").children] == ["b"]
 
 
+def test_lookup_index_tracks_appended_children():
+    root = loads('"Root"\n{\n\t"a"\t\t"1"\n}\n')
+    block = root.find("Root")
+
+    assert block.find("b") is None
+    block.set_path(("B",), "2")
+    block.children.append(VdfNode("A", value="3"))
+
+    assert [n.value for n in block.find_all("b")] == ["2"]
+    assert [n.value for n in block.find_all("a")] == ["1", "3"]
+
+
+def test_lookup_index_is_rebuilt_after_mutation():
+    root = loads('"Root"\n{\n\t"a"\t\t"1"\n\t"b"\t\t"2"\n\t"a"\t\t"3"\n}\n')
+    block = root.find("Root")
+
+    assert [n.value for n in block.find_all("a")] == ["1", "3"]
+    block.children.insert(1, VdfNode("a", value="0"))
+    assert [n.value for n in block.find_all("a")] == ["1", "0", "3"]
+    del block.children[0]
+    assert [n.value for n in block.find_all("a")] == ["0", "3"]
+    block.remove("A")
+    assert block.find("a") is None
+    block.children = [VdfNode("a", value="4")]
+    assert [n.value for n in block.find_all("a")] == ["4"]
+
+
 @pytest.mark.parametrize(
     "text",
     [
@@ -157,3 +186,98 @@ def test_syntax_error_reports_line():
         loads('"Root"\n{\n\t"key"\n}\n')
 
     assert excinfo.value.line == 4
+
+
+def test_syntax_error_line_counts_newlines_inside_strings_and_comments():
+    with pytest.raises(VdfSyntaxError) as excinfo:
+        loads('"Root"\n{\n\t"a"\t\t"multi\nline" // comment\n\t"key"\n}\n')
+
+    assert excinfo.value.line == 6
+
+
+def test_unterminated_string_reports_last_line():
+    with pytest.raises(VdfSyntaxError) as excinfo:
+        loads('"Root"\n{\n\t"a"\t\t"open\nstill open\n')
+
+    assert excinfo.value.line == 5
+
+
+def test_escaped_quote_and_trailing_backslash_in_strings():
+    root = loads('"a"\t\t"say \\"hi\\""\n"b"\t\t"C:\\\\"\n')
+
+    assert root.find("a").value == 'say "hi"'
+    assert root.find("b").value == "C:\\"
+
+
+def test_dump_streams_same_bytes_as_dumps():
+    root = loads(SAMPLE)
+    root.find("InstallConfigStore").set_path(("Ünïcode", "k"), 'quote " and \\')
+    buffer = io.BytesIO()
+
+    dump(root, buffer)
+
+    assert buffer.getvalue() == dumps(root).encode("utf-8")
+    assert not buffer.closed
+
+
+HAND_WRITTEN = """\
+// edited by hand
+Root {
+    "keep"   "as is"   // trailing comment
+    Apps
+    {
+        620 { LaunchOptions "-novid" }
+        "730"
+        {
+            "LaunchOptions"		"old"
+        }
+    }
+}
+"""
+
+
+def test_lossless_round_trip_is_verbatim():
+    assert dumps(loads(HAND_WRITTEN, lossless=True)) == HAND_WRITTEN
+
+
+def test_lossless_only_rewrites_changed_value():
+    root = loads(HAND_WRITTEN, lossless=True)
+
+    next(root.find_all("Root", "Apps", "730", "LaunchOptions")).value = "new"
+
+    assert dumps(root) == HAND_WRITTEN.replace('"old"', '"new"')
+
+
+def test_lossless_splices_added_and_removed_nodes():
+    root = loads(HAND_WRITTEN, lossless=True)
+    apps = next(root.find_all("Root", "Apps"))
+
+    apps.remove("620")
+    apps.find("730").set_path(("Extra",), "1")
+    buffer = io.BytesIO()
+    dump(root, buffer)
+
+    assert buffer.getvalue().decode("utf-8") == """\
+// edited by hand
+Root {
+    "keep"   "as is"   // trailing comment
+    Apps
+    {
+        "730"
+        {
+            "LaunchOptions"		"old"
+			"Extra"		"1"
+        }
+    }
+}
+"""
+
+
+def test_lossless_matches_plain_writer_for_steam_formatted_files():
+    root = loads(SAMPLE, lossless=True)
+    steam = next(root.find_all("InstallConfigStore", "Software", "Valve", "Steam"))
+
+    steam.set_path(("CompatToolMapping", "620", "name"), "GE-Proton")
+    steam.remove("AutoUpdateWindowEnabled")
+
+    assert dumps(root) == dumps(loads(dumps(root)))